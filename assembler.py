@@ -0,0 +1,91 @@
+import logging
+import re
+import time
+from typing import Optional
+
+from aiogram.types import Message
+from pydantic import BaseModel
+
+from config import ASSEMBLY_TIMEOUT, CORRELATION_TAG_PATTERN
+
+REQUIRED_KEYS = ['chart_photo_id', 'stats_text', 'stats_file_id', 'win_photo_id']
+
+
+class PostBundle(BaseModel):
+    correlation_id: str
+    parts: dict[str, str] = {}
+    media_group_ids: list[str] = []
+    updated_at: float = 0
+
+    @property
+    def is_complete(self) -> bool:
+        return all(key in self.parts for key in REQUIRED_KEYS)
+
+    def is_completed_by(self, key: str) -> bool:
+        return all(required_key in self.parts or required_key == key for required_key in REQUIRED_KEYS)
+
+
+class PostAssembler:
+    def __init__(self):
+        self.bundles: dict[str, PostBundle] = {}
+
+    @staticmethod
+    def get_correlation_id(message: Message) -> Optional[str]:
+        tag_match = re.search(CORRELATION_TAG_PATTERN, message.text or message.caption or '')
+        return f'tag:{tag_match.group(1)}' if tag_match else None
+
+    @staticmethod
+    def strip_correlation_tag(text: str) -> str:
+        return re.sub(CORRELATION_TAG_PATTERN, '', text)
+
+    def find_untagged_bundle(self, key: str, media_group_id: Optional[str]) -> Optional[PostBundle]:
+        if media_group_id:
+            for bundle in self.bundles.values():
+                if media_group_id in bundle.media_group_ids:
+                    return bundle
+
+        expired_at = time.time() - ASSEMBLY_TIMEOUT
+        untagged_bundles = [
+            bundle for bundle in self.bundles.values()
+            if not bundle.correlation_id.startswith('tag:') and not bundle.is_complete and key not in bundle.parts and bundle.updated_at >= expired_at
+        ]
+
+        return max(untagged_bundles, key=lambda bundle: (bundle.is_completed_by(key), bundle.updated_at), default=None)
+
+    def add_part(self, correlation_id: Optional[str], key: str, value: str, media_group_id: Optional[str] = None) -> Optional[PostBundle]:
+        self.expire_bundles()
+
+        bundle = self.bundles.get(correlation_id) if correlation_id else self.find_untagged_bundle(key, media_group_id)
+        if not bundle:
+            bundle = PostBundle(correlation_id=correlation_id or (f'group:{media_group_id}' if media_group_id else f'untagged:{time.time_ns()}'))
+            self.bundles[bundle.correlation_id] = bundle
+
+        if media_group_id and media_group_id not in bundle.media_group_ids:
+            bundle.media_group_ids.append(media_group_id)
+
+        was_complete = bundle.is_complete
+        bundle.parts[key] = value
+        bundle.updated_at = time.time()
+
+        return bundle if bundle.is_complete and not was_complete else None
+
+    def remove_bundle(self, correlation_id: str):
+        self.bundles.pop(correlation_id, None)
+
+    def get_complete_bundles(self) -> list[PostBundle]:
+        return [bundle for bundle in self.bundles.values() if bundle.is_complete]
+
+    def expire_bundles(self):
+        expired_at = time.time() - ASSEMBLY_TIMEOUT
+        for correlation_id, bundle in list(self.bundles.items()):
+            if bundle.updated_at < expired_at:
+                logging.warning("Dropping expired post %s with parts %s", correlation_id, list(bundle.parts))
+                del self.bundles[correlation_id]
+
+    def dump(self) -> list[dict]:
+        return [bundle.model_dump() for bundle in self.bundles.values()]
+
+    def load(self, bundles: list[dict]):
+        for bundle_data in bundles:
+            bundle = PostBundle.model_validate(bundle_data)
+            self.bundles[bundle.correlation_id] = bundle
@@ -0,0 +1,318 @@
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeTelegramServer:
+    def __init__(self, latency: float, error_rate: float, retry_after: int):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.message_ids = itertools.count(1)
+        self.requests = Counter()
+        self.rate_limited = Counter()
+
+    def build_message(self, chat_id: str) -> dict:
+        chat_id = int(chat_id)
+        return {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"}
+        }
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = await request.post()
+        self.requests[method] += 1
+
+        await asyncio.sleep(self.latency)
+
+        if method.startswith("send") and random.random() < self.error_rate:
+            self.rate_limited[method] += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after}
+            })
+
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+        elif method == "sendMediaGroup":
+            result = [self.build_message(data["chat_id"]) for _ in json.loads(data["media"])]
+        elif method.startswith(("send", "copy", "forward", "edit")) and "chat_id" in data:
+            result = self.build_message(data["chat_id"])
+        else:
+            result = True
+
+        return web.json_response({"ok": True, "result": result})
+
+
+class FakeOpenAIServer:
+    def __init__(self, latency: float, error_rate: float, chunks: int):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.chunks = chunks
+        self.requests = Counter()
+        self.rate_limited = Counter()
+
+    @staticmethod
+    def build_content(body: dict) -> str:
+        prompt = body["messages"][-1]["content"]
+        if body.get("response_format", {}).get("type") == "json_object":
+            languages = re.findall(r"^- ([^.\n]+)", prompt, re.MULTILINE)
+            return json.dumps({language: f"Перевод ({language}): {prompt[-80:]}" for language in languages}, ensure_ascii=False)
+
+        prompt_hash = hashlib.sha1(prompt.encode()).hexdigest()[:8]
+        return " ".join(f"Сгенерированный текст поста {prompt_hash}, часть {i}." for i in range(10))
+
+    @staticmethod
+    def build_usage(body: dict, content: str) -> dict:
+        prompt_tokens = len(body["messages"][-1]["content"]) // 4
+        completion_tokens = len(content) // 4
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        prompt_type = "stream" if body.get("stream") else "completion"
+        self.requests[prompt_type] += 1
+
+        if random.random() < self.error_rate:
+            self.rate_limited[prompt_type] += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                status=429, headers={"retry-after-ms": "50"}
+            )
+
+        content = self.build_content(body)
+        usage = self.build_usage(body, content)
+        completion = {"id": "chatcmpl-benchmark", "created": int(time.time()), "model": body["model"]}
+
+        if not body.get("stream"):
+            await asyncio.sleep(self.latency)
+            return web.json_response({
+                **completion,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        words = content.split(" ")
+        chunk_size = max(1, len(words) // self.chunks)
+        for i in range(0, len(words), chunk_size):
+            await asyncio.sleep(self.latency / self.chunks)
+            delta = " ".join(words[i:i + chunk_size]) + " "
+            chunk = {**completion, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+
+        usage_chunk = {**completion, "object": "chat.completion.chunk", "choices": [], "usage": usage}
+        await response.write(f"data: {json.dumps(usage_chunk)}\n\ndata: [DONE]\n\n".encode())
+        await response.write_eof()
+
+        return response
+
+
+async def start_server(routes: list[web.RouteDef], port: int) -> web.AppRunner:
+    app = web.Application()
+    app.add_routes(routes)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+
+    return runner
+
+
+def build_burst(watch_channel_id: int, rounds: int, win_percent: int) -> list[dict]:
+    update_ids = itertools.count(1)
+    chat = {"id": watch_channel_id, "type": "channel", "title": "Watch"}
+
+    def channel_post(**content) -> dict:
+        update_id = next(update_ids)
+        return {"update_id": update_id, "channel_post": {"message_id": update_id, "date": int(time.time()), "chat": chat, **content}}
+
+    updates = []
+    for i in range(1, rounds + 1):
+        updates.extend([
+            channel_post(text=f"#stat #round_{i}\nКоэффициенты раунда {i}: 1.2x, 3.4x, 2.1x"),
+            channel_post(caption=f"#chart #round_{i}", photo=[{"file_id": f"chart-{i}", "file_unique_id": f"chart-{i}", "width": 1, "height": 1}]),
+            channel_post(caption=f"#file #round_{i}", document={"file_id": f"file-{i}", "file_unique_id": f"file-{i}"}),
+            channel_post(caption=f"#win #round_{i} {win_percent + i}%", photo=[{"file_id": f"win-{i}", "file_unique_id": f"win-{i}", "width": 1, "height": 1}])
+        ])
+
+    return updates
+
+
+def load_burst(filename: str) -> list[dict]:
+    with open(filename) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def get_histogram_count(histogram, **labels) -> int:
+    return sum(
+        count for key, (_, (count, _)) in histogram.observations.items()
+        if all(dict(zip(histogram.label_names, key)).get(name) == str(value) for name, value in labels.items())
+    )
+
+
+def summarize_histograms(*histograms) -> dict[str, dict]:
+    summary = {}
+    for histogram in histograms:
+        for key, (bucket_counts, (count, total)) in sorted(histogram.observations.items()):
+            p95_bucket = next((bucket for bucket, bucket_count in zip(histogram.buckets, bucket_counts) if bucket_count >= count * 0.95), float("inf"))
+            name = histogram.name + "".join(f" {label_name}={value}" for label_name, value in zip(histogram.label_names, key))
+            summary[name] = {"count": count, "mean_ms": total / count * 1000, "p95_le_ms": p95_bucket * 1000}
+
+    return summary
+
+
+async def wait_until(predicate, timeout: float) -> bool:
+    deadline = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > deadline:
+            return False
+
+        await asyncio.sleep(0.01)
+
+    return True
+
+
+async def run(args: argparse.Namespace):
+    import container
+    import handlers
+    import jobs
+    import main
+    import metrics
+    import sender
+    from config import LANGUAGE_CHANNELS, WATCH_CHANNEL_ID, WIN_BIG_PERCENT
+
+    telegram_server = FakeTelegramServer(args.telegram_latency, args.telegram_429_rate, args.telegram_retry_after)
+    openai_server = FakeOpenAIServer(args.openai_latency, args.openai_429_rate, args.openai_chunks)
+    runners = [
+        await start_server([web.post("/bot{token}/{method}", telegram_server.handle)], args.telegram_port),
+        await start_server([web.post("/v1/chat/completions", openai_server.handle)], args.openai_port)
+    ]
+
+    container.app = container.Container()
+    await container.app.init_database()
+    dispatcher = main.create_dispatcher()
+
+    container.app.state.moderation_enabled = False
+    container.app.state.generation_enabled = True
+    handlers.POST_WIN_DELAY = 0
+    if args.chat_rate:
+        sender.TELEGRAM_PRIVATE_CHAT_RATE = sender.TELEGRAM_GROUP_CHAT_RATE = args.chat_rate
+
+    updates = load_burst(args.updates) if args.updates else build_burst(WATCH_CHANNEL_ID, args.rounds, WIN_BIG_PERCENT)
+    expected_posts = sum(1 for update in updates if "#win" in update.get("channel_post", {}).get("caption", ""))
+    expected_wins = expected_posts * len(LANGUAGE_CHANNELS)
+
+    metrics.reset()
+    jobs_task = asyncio.create_task(jobs.run_jobs())
+    handlers.generation_queue.start()
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(dispatcher.feed_raw_update(container.app.bot, update) for update in updates))
+    ingested_at = time.perf_counter()
+
+    completed = await wait_until(lambda: get_histogram_count(metrics.PUBLISH_DURATION, step="win") >= expected_wins, args.timeout)
+    elapsed = time.perf_counter() - started_at
+
+    jobs_task.cancel()
+    await dispatcher.emit_shutdown(bot=container.app.bot)
+    for runner in runners:
+        await runner.cleanup()
+
+    published_posts = get_histogram_count(metrics.PUBLISH_DURATION, step="win") // len(LANGUAGE_CHANNELS)
+    results = {
+        "completed": completed,
+        "updates": len(updates),
+        "posts": published_posts,
+        "elapsed_s": elapsed,
+        "ingest_updates_per_s": len(updates) / (ingested_at - started_at),
+        "posts_per_s": published_posts / elapsed,
+        "stages": summarize_histograms(
+            metrics.UPDATE_DURATION, metrics.QUEUE_WAIT_DURATION, metrics.PIPELINE_STAGE_DURATION,
+            metrics.PUBLISH_DURATION, metrics.CHATGPT_REQUEST_DURATION, metrics.DATABASE_COMMIT_DURATION
+        ),
+        "db_writes": {
+            statement: get_histogram_count(metrics.DATABASE_QUERY_DURATION, statement=statement)
+            for statement in ("INSERT", "UPDATE", "DELETE")
+        },
+        "db_commits": get_histogram_count(metrics.DATABASE_COMMIT_DURATION),
+        "telegram_requests": dict(telegram_server.requests),
+        "telegram_429": dict(telegram_server.rate_limited),
+        "openai_requests": dict(openai_server.requests),
+        "openai_429": dict(openai_server.rate_limited)
+    }
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+
+    print(
+        f"{results['posts']}/{expected_posts} posts from {len(updates)} updates in {elapsed:.2f} s "
+        f"({results['posts_per_s']:.2f} posts/s, ingest {results['ingest_updates_per_s']:.0f} updates/s)"
+        + ("" if completed else " — timed out")
+    )
+    for name, stage in results["stages"].items():
+        print(f"  {name:<64} n={stage['count']:<5} mean {stage['mean_ms']:8.1f} ms  p95 <= {stage['p95_le_ms']:.0f} ms")
+
+    print(f"  db writes {results['db_writes']}, commits {results['db_commits']}")
+    print(f"  telegram {results['telegram_requests']}, 429 {results['telegram_429']}")
+    print(f"  openai {results['openai_requests']}, 429 {results['openai_429']}")
+
+
+def configure_environment(args: argparse.Namespace, workdir: str):
+    os.environ.update(
+        BOT_TOKEN="123456:benchmark",
+        BOT_OWNER_ID="1",
+        WATCH_CHANNEL_ID="-1001",
+        CHATGPT_API_KEY="sk-benchmark",
+        CHATGPT_BASE_URL=f"http://127.0.0.1:{args.openai_port}/v1",
+        TELEGRAM_API_URL=f"http://127.0.0.1:{args.telegram_port}",
+        DATABASE_URL=f"sqlite+aiosqlite:///{os.path.join(workdir, 'benchmark.db')}",
+        WEBHOOK_URL=""
+    )
+    os.chdir(workdir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a burst of watch channel posts against fake Telegram and OpenAI servers")
+    parser.add_argument("--rounds", type=int, default=20, help="Number of #stat/#chart/#file/#win rounds in the synthetic burst")
+    parser.add_argument("--updates", help="JSON lines file with recorded raw updates to replay instead of the synthetic burst")
+    parser.add_argument("--telegram-latency", type=float, default=0.05)
+    parser.add_argument("--telegram-429-rate", type=float, default=0.0)
+    parser.add_argument("--telegram-retry-after", type=int, default=1)
+    parser.add_argument("--chat-rate", type=float, help="Override the per-chat send rate (messages/s); production limits are used by default")
+    parser.add_argument("--openai-latency", type=float, default=0.5)
+    parser.add_argument("--openai-429-rate", type=float, default=0.0)
+    parser.add_argument("--openai-chunks", type=int, default=10)
+    parser.add_argument("--telegram-port", type=int, default=8281)
+    parser.add_argument("--openai-port", type=int, default=8282)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure_environment(args, workdir)
+        asyncio.run(run(args))
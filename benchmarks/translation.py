@@ -0,0 +1,90 @@
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chatgpt
+import container
+import database
+from config import LANGUAGE_CHANNELS
+
+SAMPLE_TEXT = "🚀 Коэффициенты растут: ждём выход выше 2.5x в ближайших раундах. Заходим аккуратно и фиксируем прибыль! 💎"
+
+
+class UsageCounter:
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.requests = 0
+
+    def wrap(self, create):
+        async def create_with_usage(*args, **kwargs):
+            completion = await create(*args, **kwargs)
+            self.requests += 1
+            if completion.usage:
+                self.prompt_tokens += completion.usage.prompt_tokens
+                self.completion_tokens += completion.usage.completion_tokens
+            return completion
+
+        return create_with_usage
+
+
+async def translate_per_language(original_text: str) -> dict:
+    channels = [channel for channel in LANGUAGE_CHANNELS if not channel.is_default]
+    translated_texts = await asyncio.gather(*(chatgpt.translate_text(channel.language, channel.language_note, original_text) for channel in channels))
+    return {channel.language: translated_text for channel, translated_text in zip(channels, translated_texts)}
+
+
+async def translate_batched(original_text: str) -> dict:
+    channels = [channel for channel in LANGUAGE_CHANNELS if not channel.is_default]
+    return await chatgpt.translate_texts([(channel.language, channel.language_note) for channel in channels], original_text)
+
+
+async def benchmark(name: str, translate, original_text: str, rounds: int):
+    usage_counter = UsageCounter()
+    completions = container.get_app().openai_client.chat.completions
+    create = completions.create
+    completions.create = usage_counter.wrap(create)
+
+    latencies = []
+    missing_languages = 0
+    try:
+        for _ in range(rounds):
+            started_at = time.perf_counter()
+            translated_texts = await translate(original_text)
+            latencies.append((time.perf_counter() - started_at) * 1000)
+
+            missing_languages += sum(
+                1 for channel in LANGUAGE_CHANNELS
+                if not channel.is_default and not str(translated_texts.get(channel.language) or "").strip()
+            )
+    finally:
+        completions.create = create
+
+    print(
+        f"{name:>12}: p50 {statistics.median(latencies):.0f} ms, max {max(latencies):.0f} ms, "
+        f"{usage_counter.requests / rounds:.1f} requests, {usage_counter.prompt_tokens / rounds:.0f} prompt + "
+        f"{usage_counter.completion_tokens / rounds:.0f} completion tokens per post, {missing_languages} missing translations"
+    )
+
+
+async def run(args: argparse.Namespace):
+    await container.get_app().init_database()
+
+    await benchmark("per-language", translate_per_language, args.text, args.rounds)
+    await benchmark("batched", translate_batched, args.text, args.rounds)
+    await chatgpt.close()
+    await container.get_app().close()
+    await database.close_database()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare per-language and batched translation latency and token usage")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--text", default=SAMPLE_TEXT)
+
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,174 @@
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import ClientSession, web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import container
+import main
+from config import BOT_TOKEN, WEBHOOK_PATH, WEBHOOK_SECRET
+
+
+def build_update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": 42, "type": "private"},
+            "from": {"id": 42, "is_bot": False, "first_name": "Benchmark"},
+            "text": "/admin"
+        }
+    }
+
+
+class FakeUpdatesServer:
+    def __init__(self):
+        self.updates: list[dict] = []
+        self.updates_added = asyncio.Event()
+
+    def add_update(self, update: dict):
+        self.updates.append(update)
+        self.updates_added.set()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = await request.post()
+
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}})
+
+        if method == "getUpdates":
+            offset = int(data.get("offset", 0))
+            timeout = float(data.get("timeout", 0))
+
+            pending_updates = [update for update in self.updates if update["update_id"] >= offset]
+            if not pending_updates:
+                self.updates_added.clear()
+                try:
+                    await asyncio.wait_for(self.updates_added.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                pending_updates = [update for update in self.updates if update["update_id"] >= offset]
+
+            return web.json_response({"ok": True, "result": pending_updates})
+
+        return web.json_response({"ok": True, "result": True})
+
+
+def track_handled_updates(dispatcher: Dispatcher) -> dict[int, float]:
+    handled_at = {}
+
+    @dispatcher.update.outer_middleware()
+    async def record_handled_update(handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            handled_at[event.update_id] = time.perf_counter()
+
+    return handled_at
+
+
+async def wait_for_updates(handled_at: dict[int, float], update_ids: list[int], timeout: float):
+    deadline = time.perf_counter() + timeout
+    while not all(update_id in handled_at for update_id in update_ids) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.001)
+
+
+def report(mode: str, sent_at: dict[int, float], handled_at: dict[int, float], elapsed: float):
+    latencies = sorted((handled_at[update_id] - sent_at[update_id]) * 1000 for update_id in sent_at if update_id in handled_at)
+    if not latencies:
+        print(f"{mode:>8}: no updates handled")
+        return
+
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if len(latencies) > 1 else latencies[0]
+    print(
+        f"{mode:>8}: {len(latencies)}/{len(sent_at)} updates, {len(latencies) / elapsed:.1f} updates/s, "
+        f"p50 {statistics.median(latencies):.2f} ms, p95 {p95:.2f} ms, max {latencies[-1]:.2f} ms"
+    )
+
+
+async def benchmark_webhook(dispatcher: Dispatcher, handled_at: dict[int, float], count: int, concurrency: int, port: int):
+    runner = web.AppRunner(main.create_webhook_app(dispatcher))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+
+    url = f"http://127.0.0.1:{port}{WEBHOOK_PATH}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET} if WEBHOOK_SECRET else {}
+    semaphore = asyncio.Semaphore(concurrency)
+    sent_at = {}
+
+    async def post_update(session: ClientSession, update_id: int):
+        async with semaphore:
+            sent_at[update_id] = time.perf_counter()
+            async with session.post(url, json=build_update(update_id), headers=headers) as response:
+                response.raise_for_status()
+
+    started_at = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(post_update(session, update_id) for update_id in range(1, count + 1)))
+
+    await wait_for_updates(handled_at, list(sent_at), timeout=30)
+    report("webhook", sent_at, handled_at, time.perf_counter() - started_at)
+
+    await runner.cleanup()
+
+
+async def benchmark_polling(dispatcher: Dispatcher, handled_at: dict[int, float], count: int, port: int):
+    updates_server = FakeUpdatesServer()
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", updates_server.handle)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+
+    polling_bot = Bot(BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{port}")))
+    polling_task = asyncio.create_task(dispatcher.start_polling(polling_bot, handle_signals=False, polling_timeout=10))
+    await asyncio.sleep(0.5)
+
+    sent_at = {}
+    started_at = time.perf_counter()
+    for update_id in range(1, count + 1):
+        sent_at[update_id] = time.perf_counter()
+        updates_server.add_update(build_update(update_id))
+        await asyncio.sleep(0)
+
+    await wait_for_updates(handled_at, list(sent_at), timeout=30)
+    report("polling", sent_at, handled_at, time.perf_counter() - started_at)
+
+    await dispatcher.stop_polling()
+    await polling_task
+    await runner.cleanup()
+
+
+async def run(args: argparse.Namespace):
+    await container.get_app().init_database()
+
+    dispatcher = main.create_dispatcher()
+    handled_at = track_handled_updates(dispatcher)
+
+    if args.mode in ("webhook", "both"):
+        await benchmark_webhook(dispatcher, handled_at, args.count, args.concurrency, args.port)
+        handled_at.clear()
+
+    if args.mode in ("polling", "both"):
+        await benchmark_polling(dispatcher, handled_at, args.count, args.port + 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Post fake updates to the bot and measure update handling latency")
+    parser.add_argument("--mode", choices=("webhook", "polling", "both"), default="both")
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--port", type=int, default=8181)
+
+    asyncio.run(run(parser.parse_args()))
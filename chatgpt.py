@@ -1,28 +1,120 @@
-from openai import OpenAI
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Optional
 
-from config import CHATGPT_API_KEY, CHATGPT_SYSTEM_PROMPT, CHATGPT_SETTINGS, CHATGPT_TRANSLATE_PROMPT
+import database
+import metrics
+from config import CHATGPT_PRICES, CHATGPT_SYSTEM_PROMPT, CHATGPT_SETTINGS, CHATGPT_TRANSLATE_PROMPT, CHATGPT_BATCH_TRANSLATE_PROMPT
+from container import get_app
 
-client = OpenAI(api_key=CHATGPT_API_KEY)
+metric_tasks: set[asyncio.Task] = set()
 
 
-def generate_text(stats_text: str, text_length: int) -> str:
-    completion = client.chat.completions.create(
-        messages=[{
-            "role": "user",
-            "content": CHATGPT_SYSTEM_PROMPT.format(stats_text=stats_text, text_length=text_length)
-        }],
-        **CHATGPT_SETTINGS
-    )
-    return completion.choices[0].message.content
+def on_metric_saved(task: asyncio.Task):
+    metric_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        logging.error("Failed to save completion metric", exc_info=task.exception())
+
+
+def record_completion_metric(completion_metric: database.CompletionMetric):
+    metrics.CHATGPT_REQUEST_DURATION.observe(completion_metric.latency_ms / 1000, prompt_type=completion_metric.prompt_type, outcome=completion_metric.outcome)
+    metrics.CHATGPT_TOKENS.inc(completion_metric.prompt_tokens, prompt_type=completion_metric.prompt_type, kind='prompt')
+    metrics.CHATGPT_TOKENS.inc(completion_metric.completion_tokens, prompt_type=completion_metric.prompt_type, kind='completion')
+
+    task = asyncio.create_task(database.save_completion_metric(completion_metric))
+    metric_tasks.add(task)
+    task.add_done_callback(on_metric_saved)
+
+
+@asynccontextmanager
+async def track_completion(prompt_type: str, language: Optional[str] = None) -> AsyncIterator[database.CompletionMetric]:
+    completion_metric = database.CompletionMetric(prompt_type=prompt_type, language=language, model=CHATGPT_SETTINGS['model'])
+    started_at = time.perf_counter()
+
+    try:
+        yield completion_metric
+    except asyncio.CancelledError:
+        completion_metric.outcome = 'cancelled'
+        raise
+    except Exception as error:
+        completion_metric.outcome = type(error).__name__
+        raise
+    finally:
+        completion_metric.latency_ms = (time.perf_counter() - started_at) * 1000
+        try:
+            record_completion_metric(completion_metric)
+        except Exception:
+            logging.exception("Failed to record completion metric")
+
+
+def get_completion_cost(completion_metric: database.CompletionMetric) -> float:
+    prompt_price, completion_price = CHATGPT_PRICES.get(completion_metric.model, (0, 0))
+    return (completion_metric.prompt_tokens * prompt_price + completion_metric.completion_tokens * completion_price) / 1_000_000
+
+
+def set_usage(completion_metric: database.CompletionMetric, usage):
+    if usage:
+        completion_metric.prompt_tokens = usage.prompt_tokens
+        completion_metric.completion_tokens = usage.completion_tokens
 
 
-def translate_text(language: str, language_note: str, original_text: str) -> str:
-    completion = client.chat.completions.create(
-        messages=[{
-            "role": "user",
-            "content": CHATGPT_TRANSLATE_PROMPT.format(language=language, language_note=language_note, original_text=original_text)
-        }],
-        **CHATGPT_SETTINGS
-    )
+async def generate_text(stats_text: str, text_length: int, on_progress: Optional[Callable[[str], Awaitable]] = None) -> str:
+    messages = [{
+        "role": "user",
+        "content": CHATGPT_SYSTEM_PROMPT.format(stats_text=stats_text, text_length=text_length)
+    }]
+
+    async with track_completion('generate') as completion_metric:
+        if not on_progress:
+            completion = await get_app().openai_client.chat.completions.create(messages=messages, **CHATGPT_SETTINGS)
+            set_usage(completion_metric, completion.usage)
+            return completion.choices[0].message.content
+
+        generated_text = ""
+        async with await get_app().openai_client.chat.completions.create(messages=messages, stream=True, stream_options={"include_usage": True}, **CHATGPT_SETTINGS) as stream:
+            async for chunk in stream:
+                set_usage(completion_metric, chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    generated_text += chunk.choices[0].delta.content
+                    await on_progress(generated_text)
+
+        return generated_text
+
+
+async def translate_text(language: str, language_note: str, original_text: str) -> str:
+    async with track_completion('translate', language) as completion_metric:
+        completion = await get_app().openai_client.chat.completions.create(
+            messages=[{
+                "role": "user",
+                "content": CHATGPT_TRANSLATE_PROMPT.format(language=language, language_note=language_note, original_text=original_text)
+            }],
+            **CHATGPT_SETTINGS
+        )
+        set_usage(completion_metric, completion.usage)
 
     return completion.choices[0].message.content
+
+
+async def translate_texts(languages: list[tuple[str, str]], original_text: str) -> dict:
+    async with track_completion('batch_translate') as completion_metric:
+        completion = await get_app().openai_client.chat.completions.create(
+            messages=[{
+                "role": "user",
+                "content": CHATGPT_BATCH_TRANSLATE_PROMPT.format(
+                    languages="\n".join(f"- {language}. {language_note}".rstrip() for language, language_note in languages),
+                    original_text=original_text
+                )
+            }],
+            response_format={"type": "json_object"},
+            **CHATGPT_SETTINGS
+        )
+        set_usage(completion_metric, completion.usage)
+
+    return json.loads(completion.choices[0].message.content)
+
+
+async def close():
+    await asyncio.gather(*metric_tasks, return_exceptions=True)
@@ -1,4 +1,6 @@
+import asyncio
 import os
+import socket
 
 from dotenv import load_dotenv
 from pydantic import BaseModel
@@ -10,6 +12,40 @@ BOT_OWNER_ID = int(os.getenv("BOT_OWNER_ID"))
 WATCH_CHANNEL_ID = int(os.getenv("WATCH_CHANNEL_ID"))
 
 CHATGPT_API_KEY = os.getenv("CHATGPT_API_KEY")
+CHATGPT_BASE_URL = os.getenv("CHATGPT_BASE_URL") or None
+
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL") or None
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))
+
+REDIS_URL = os.getenv("REDIS_URL") or None
+REDIS_PREFIX = os.getenv("REDIS_PREFIX", "iguild-post-bot")
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+SHARED_LOCK_TIMEOUT = 600
+LEADER_LEASE_TTL = 30
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///database.db")
+DATABASE_POOL_SIZE = 5
+
+RETENTION_DAYS = {
+    "winpercent": 90,
+    "winmessage": 90,
+    "post": 180,
+    "winspost": 180,
+    "job": 7,
+    "completionmetric": 90,
+    "delivery": 180
+}
+RETENTION_BATCH_SIZE = 500
+RETENTION_VACUUM_PAGES = 1000
+ARCHIVE_DIR = "archive"
 
 CHATGPT_SYSTEM_PROMPT = """
 Проанализируй данные.
@@ -47,10 +83,35 @@ CHATGPT_TRANSLATE_PROMPT = """
 Текст: {original_text}
 """
 
+CHATGPT_BATCH_TRANSLATE_PROMPT = """
+Переведи текст на каждый из языков списка:
+{languages}
+::
+Переводи натурально, будь ближе к читателю, используй сленг трейдеров и игроков онлайн казино.
+::
+Максимально сохраняй оригинальный стиль, эмодзи и форматирование.
+::
+Верни только JSON-объект, где ключ — название языка из списка в точности как написано, а значение — переведённый текст.
+::
+Текст: {original_text}
+"""
+
 CHATGPT_SETTINGS = dict(
     model="gpt-4o"
 )
 
+CHATGPT_PRICES = {
+    "gpt-4o": (2.5, 10.0)
+}
+
+CHATGPT_TIMEOUT = 60
+CHATGPT_MAX_RETRIES = 2
+CHATGPT_MAX_CONNECTIONS = 10
+
+TRANSLATE_CONCURRENCY = 5
+TRANSLATE_BATCHED = False
+TRANSLATION_CACHE_DAYS = 30
+
 PUBLISH_POST_BUTTON = "✅ Опубликовать"
 EDIT_POST_BUTTON = "✏️ Отредактировать"
 DELETE_POST_BUTTON = "❌ Отменить"
@@ -66,13 +127,48 @@ ADMIN_SETTINGS_TEXT = "Выберите, что хотите переключи
 MODERATION_BUTTON = "{status} Модерация постов"
 GENERATION_BUTTON = "{status} Генерация постов"
 
+STATS_TEXT = "📈 Статистика ChatGPT за {days} дн.:"
+STATS_LINE_TEXT = (
+    "<b>{prompt_type}</b> {language}\n"
+    "Вызовов: {calls}, ошибок: {errors}\n"
+    "Задержка: p50 {p50:.0f} мс, p95 {p95:.0f} мс\n"
+    "Токены: {prompt_tokens} + {completion_tokens}, ≈ ${cost:.4f}"
+)
+NO_STATS_TEXT = "📈 Статистика ChatGPT пока пуста."
+
 INVALID_MESSAGE_URL_TEXT = "❌ Некорректная ссылка на сообщение."
 BUTTON_EDITED_TEXT = "✏️ Кнопка успешно отредактирована."
 BUTTON_DELETED_TEXT = "✏️ Кнопка успешно удалена."
 BUTTON_NOT_EDITED_TEXT = "❌ Не удалось отредактировать сообщение.\n<code>{error}</code>"
 
+TELEGRAM_GLOBAL_RATE = 30
+TELEGRAM_PRIVATE_CHAT_RATE = 1
+TELEGRAM_GROUP_CHAT_RATE = 20 / 60
+TELEGRAM_CHAT_BURST = 5
+TELEGRAM_MAX_RETRIES = 5
+
+DRAFT_EDIT_INTERVAL = 1.5
+
+POST_WIN_DELAY = 180
+
+ASSEMBLY_TIMEOUT = 30 * 60
+CORRELATION_TAG_PATTERN = r'#round_(\w+)'
+
+GENERATION_QUEUE_SIZE = 10
+GENERATION_WORKERS = 2
+GENERATION_QUEUE_DROP_OLDEST = True
+
+JOBS_POLL_INTERVAL = 60
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_DELAY = 30
+JOB_CLAIM_BACKOFF = 1
+JOB_ERROR_BACKOFF = 5
+
 WIN_EMOJIS = "✅💪🎉👏🔥🤘🚀🥳💎"
 WIN_BIG_PERCENT = 10000
+WINS_MEDIA_GROUP_SIZE = 10
+
+STATS_DAYS = 7
 
 TEXT_LENGTHS = {
     160: 0.5,
@@ -82,6 +178,9 @@ TEXT_LENGTHS = {
 }
 
 
+STATE_SAVE_DELAY = 2
+
+
 class State(BaseModel):
     moderation_enabled: bool = True
     generation_enabled: bool = True
@@ -97,9 +196,45 @@ def load_state(filename="state.json") -> State:
         return State.model_validate_json(file.read())
 
 
+dirty_states: dict[str, State] = {}
+flush_state_task: asyncio.Task | None = None
+flush_state_lock = asyncio.Lock()
+
+
 def save_state(state: State, filename="state.json"):
-    with open(filename, "w") as file:
-        file.write(state.model_dump_json())
+    global flush_state_task
+
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        write_state(state.model_dump_json(), filename)
+        return
+
+    dirty_states[filename] = state
+    if not flush_state_task or flush_state_task.done():
+        flush_state_task = loop.create_task(flush_state_later())
+
+
+def write_state(state_json: str, filename: str):
+    temp_filename = f"{filename}.tmp"
+    with open(temp_filename, "w") as file:
+        file.write(state_json)
+        file.flush()
+        os.fsync(file.fileno())
+
+    os.replace(temp_filename, filename)
+
+
+async def flush_state_later():
+    await asyncio.sleep(STATE_SAVE_DELAY)
+    await flush_state()
+
+
+async def flush_state():
+    async with flush_state_lock:  # the debounced flush and the shutdown flush share the temp file
+        while dirty_states:
+            filename, state = dirty_states.popitem()
+            await asyncio.to_thread(write_state, state.model_dump_json(), filename)
 
 
 class Channel(BaseModel):
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from functools import cached_property
+from typing import Callable, Optional
+
+import httpx
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.enums import ParseMode
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from redis.asyncio import Redis
+
+import config
+import database
+import metrics
+import sender
+from config import REDIS_URL, BOT_TOKEN, TELEGRAM_API_URL, CHATGPT_API_KEY, CHATGPT_BASE_URL, CHATGPT_TIMEOUT, CHATGPT_MAX_RETRIES, CHATGPT_MAX_CONNECTIONS
+from store import LocalStore, RedisStore
+
+
+def create_bot() -> Bot:
+    bot = Bot(
+        BOT_TOKEN,
+        session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    )
+    bot.session.middleware(sender.SendScheduler())
+    bot.session.middleware(metrics.TelegramMetricsMiddleware())
+
+    return bot
+
+
+def create_openai_client() -> AsyncOpenAI:
+    return AsyncOpenAI(
+        api_key=CHATGPT_API_KEY,
+        base_url=CHATGPT_BASE_URL,
+        timeout=CHATGPT_TIMEOUT,
+        max_retries=CHATGPT_MAX_RETRIES,
+        http_client=DefaultAsyncHttpxClient(
+            limits=httpx.Limits(max_connections=CHATGPT_MAX_CONNECTIONS, max_keepalive_connections=CHATGPT_MAX_CONNECTIONS)
+        )
+    )
+
+
+def create_store() -> LocalStore | RedisStore:
+    return RedisStore(Redis.from_url(REDIS_URL)) if REDIS_URL else LocalStore()
+
+
+class Container:
+    def __init__(
+        self,
+        bot_factory: Callable[[], Bot] = create_bot,
+        openai_client_factory: Callable[[], AsyncOpenAI] = create_openai_client,
+        state_loader: Callable[[], config.State] = config.load_state,
+        store_factory: Callable[[], LocalStore | RedisStore] = create_store
+    ):
+        self.bot_factory = bot_factory
+        self.openai_client_factory = openai_client_factory
+        self.state_loader = state_loader
+        self.store_factory = store_factory
+        self.startup_timings: dict[str, float] = {}
+        self.database_ready = False
+        self.database_lock = asyncio.Lock()
+
+    @contextmanager
+    def timed(self, name: str):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.startup_timings[name] = time.perf_counter() - started_at
+
+    @cached_property
+    def bot(self) -> Bot:
+        with self.timed('bot'):
+            return self.bot_factory()
+
+    @cached_property
+    def openai_client(self) -> AsyncOpenAI:
+        with self.timed('openai_client'):
+            return self.openai_client_factory()
+
+    @cached_property
+    def state(self) -> config.State:
+        with self.timed('state'):
+            return self.state_loader()
+
+    @cached_property
+    def store(self) -> LocalStore | RedisStore:
+        with self.timed('store'):
+            return self.store_factory()
+
+    async def sync_state(self):
+        if not self.store.is_shared:
+            return
+
+        state_data = await self.store.get('state')
+        if state_data:
+            self.state = config.State.model_validate(state_data)
+
+    async def save_state(self, **changes):
+        if not self.store.is_shared:
+            for name, value in changes.items():
+                setattr(self.state, name, value)
+            config.save_state(self.state)
+            return
+
+        async with self.store.lock('state'):
+            await self.sync_state()
+            for name, value in changes.items():
+                setattr(self.state, name, value)
+            await self.store.set('state', self.state.model_dump())
+
+    async def init_database(self):
+        async with self.database_lock:
+            if self.database_ready:
+                return
+
+            with self.timed('database'):
+                await database.init_database()
+            self.database_ready = True
+
+    def log_startup_timings(self):
+        logging.info("Startup timings: %s", ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in self.startup_timings.items()))
+
+    async def close(self):
+        if 'openai_client' in self.__dict__:
+            await self.openai_client.close()
+
+        if 'bot' in self.__dict__:
+            await self.bot.session.close()
+
+        if 'store' in self.__dict__:
+            await self.store.close()
+
+
+app: Optional[Container] = None
+
+
+def get_app() -> Container:
+    global app
+
+    if app is None:
+        app = Container()
+
+    return app
@@ -1,13 +1,22 @@
 import json
+import time
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Iterable
+from typing import Any, Optional, Iterable
 
-from sqlmodel import SQLModel, Field, create_engine, Session, select
+from sqlalchemy import Index, event, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlmodel import SQLModel, Field, select, delete, func
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import metrics
+from config import DATABASE_URL, DATABASE_POOL_SIZE, TRANSLATION_CACHE_DAYS
 
 
 class BaseModel(SQLModel):
     id: Optional[int] = Field(default=None, primary_key=True)
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), index=True)
 
 
 class Post(BaseModel, table=True):
@@ -21,6 +30,12 @@ class Post(BaseModel, table=True):
     is_published: bool = False
 
 
+class Translation(BaseModel, table=True):
+    cache_key: str = Field(index=True, unique=True)
+    language: str
+    translated_text: str
+
+
 class WinsPost(BaseModel, table=True):
     win_photo_ids_json: str = Field(repr=False, nullable=False)
     is_published: bool = False
@@ -39,77 +54,376 @@ class WinsPost(BaseModel, table=True):
 
 
 class WinPercent(BaseModel, table=True):
-    win_photo_id: str
+    __table_args__ = (Index("ix_winpercent_created_at_win_percent", "created_at", "win_percent"),)
+
+    win_photo_id: str = Field(index=True)
     win_percent: int
 
 
+class BestWinPercent(BaseModel, table=True):
+    win_percent_id: int
+    win_percent: int
+    win_created_at: datetime
+
+
 class WinMessage(BaseModel, table=True):
     channel_id: int
-    win_photo_id: str
+    win_photo_id: str = Field(index=True)
     win_message_id: int
     win_message_url: str
 
 
-engine = create_engine("sqlite:///database.db")
-session = Session(engine)
+class DailyAggregate(BaseModel, table=True):
+    __table_args__ = (Index("ix_dailyaggregate_table_name_day", "table_name", "day", unique=True),)
+
+    table_name: str
+    day: str
+    row_count: int = 0
+    value_sum: int = 0
+    value_max: Optional[int] = None
+
+
+class CompletionMetric(BaseModel, table=True):
+    prompt_type: str
+    language: Optional[str] = None
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency_ms: float = 0
+    outcome: str = 'ok'
+
+
+class StorageRecord(SQLModel, table=True):
+    key: str = Field(primary_key=True)
+    value_json: str
+
+
+class Job(BaseModel, table=True):
+    name: str
+    payload_json: str = Field(repr=False, nullable=False)
+    run_at: datetime
+    attempts: int = 0
+    is_done: bool = False
+
+    @property
+    def payload(self) -> dict:
+        return json.loads(self.payload_json)
+
+    @payload.setter
+    def payload(self, value: dict):
+        self.payload_json = json.dumps(value)
+
+    def __init__(self, payload: dict, **kwargs):
+        super().__init__(**kwargs)
+        self.payload = payload
+
+
+class Delivery(BaseModel, table=True):
+    __table_args__ = (Index("ix_delivery_post_id_channel_id_step", "post_id", "channel_id", "step", unique=True),)
+
+    post_id: int
+    channel_id: int
+    step: str
+    message_id: int
+
 
-SQLModel.metadata.create_all(engine)
+engine = create_async_engine(DATABASE_URL, poolclass=AsyncAdaptedQueuePool, pool_size=DATABASE_POOL_SIZE)
 
 
-def save_post(post: Post) -> Post:
-    session.add(post)
-    session.commit()
+@event.listens_for(engine.sync_engine, "connect")
+def set_sqlite_pragmas(connection, _):
+    cursor = connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def start_query_timer(connection, cursor, statement, parameters, context, executemany):
+    connection.info["query_started_at"] = time.perf_counter()  # a failed statement leaves it behind until the next one overwrites it
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def stop_query_timer(connection, cursor, statement, parameters, context, executemany):
+    started_at = connection.info.pop("query_started_at", None)
+    if started_at is None:
+        return
+
+    metrics.DATABASE_QUERY_DURATION.observe(time.perf_counter() - started_at, statement=statement.split(None, 1)[0].upper())
+
+
+class MeteredSession(AsyncSession):
+    async def commit(self):
+        with metrics.DATABASE_COMMIT_DURATION.time():
+            await super().commit()
+
+
+def new_session() -> AsyncSession:
+    return MeteredSession(engine, expire_on_commit=False)
+
+
+def create_schema(connection):
+    SQLModel.metadata.create_all(connection)
+
+    for table in SQLModel.metadata.tables.values():
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+async def init_database():
+    async with engine.begin() as connection:
+        await connection.run_sync(create_schema)
+
+
+async def close_database():
+    await engine.dispose()
+
+
+async def save_post(post: Post) -> Post:
+    async with new_session() as session:
+        session.add(post)
+        await session.commit()
+
     return post
 
 
-def get_post(post_id: int) -> Optional[Post]:
-    return session.get(Post, post_id)
+async def get_post(post_id: int) -> Optional[Post]:
+    async with new_session() as session:
+        return await session.get(Post, post_id)
+
+
+async def delete_post(post: Post):
+    async with new_session() as session:
+        await session.delete(post)
+        await session.commit()
+
+
+async def get_translation(cache_key: str) -> Optional[Translation]:
+    query = select(Translation).where(Translation.cache_key == cache_key)
+
+    async with new_session() as session:
+        return (await session.exec(query)).first()
+
 
+async def save_translation(translation: Translation) -> Translation:
+    expired_at = datetime.now(timezone.utc) - timedelta(days=TRANSLATION_CACHE_DAYS)
 
-def delete_post(post: Post):
-    session.delete(post)
-    session.commit()
+    async with new_session() as session:
+        await session.exec(delete(Translation).where(Translation.created_at < expired_at))  # type: ignore
+        session.add(translation)
+        try:
+            await session.commit()
+        except IntegrityError:
+            await session.rollback()  # the same text was translated and cached concurrently
 
+    return translation
+
+
+async def save_wins_post(wins_post: WinsPost) -> WinsPost:
+    async with new_session() as session:
+        session.add(wins_post)
+        await session.commit()
 
-def save_wins_post(wins_post: WinsPost) -> WinsPost:
-    session.add(wins_post)
-    session.commit()
     return wins_post
 
 
-def get_wins_post(post_id: int) -> Optional[WinsPost]:
-    return session.get(WinsPost, post_id)
+async def get_wins_post(post_id: int) -> Optional[WinsPost]:
+    async with new_session() as session:
+        return await session.get(WinsPost, post_id)
+
+
+async def delete_wins_post(wins_post: WinsPost):
+    async with new_session() as session:
+        await session.delete(wins_post)
+        await session.commit()
+
+
+def get_best_win_period_start() -> datetime:
+    return datetime.now(timezone.utc) - timedelta(days=1)
+
 
+async def save_win_percent(win_percent: WinPercent) -> WinPercent:
+    async with new_session() as session:
+        session.add(win_percent)
+        await session.flush()
 
-def delete_wins_post(wins_post: WinsPost):
-    session.delete(wins_post)
-    session.commit()
+        best_win_percent = await session.get(BestWinPercent, 1)
+        if not best_win_percent or best_win_percent.win_created_at.replace(tzinfo=timezone.utc) < get_best_win_period_start():
+            query = (
+                select(WinPercent)
+                .where(WinPercent.created_at >= get_best_win_period_start())
+                .order_by(WinPercent.win_percent.desc())
+            )
+            leader = (await session.exec(query)).first()
+        elif win_percent.win_percent > best_win_percent.win_percent:
+            leader = win_percent
+        else:
+            leader = None
 
+        if leader:
+            await session.merge(BestWinPercent(
+                id=1,
+                win_percent_id=leader.id,
+                win_percent=leader.win_percent,
+                win_created_at=leader.created_at
+            ))
+
+        await session.commit()
 
-def save_win_percent(win_percent: WinPercent) -> WinPercent:
-    session.add(win_percent)
-    session.commit()
     return win_percent
 
 
-def get_best_win_percent() -> Optional[WinPercent]:
-    yesterday = datetime.now(timezone.utc) - timedelta(days=1)
+async def get_best_win_percent() -> Optional[WinPercent]:
+    async with new_session() as session:
+        best_win_percent = await session.get(BestWinPercent, 1)
+        if best_win_percent and best_win_percent.win_created_at.replace(tzinfo=timezone.utc) >= get_best_win_period_start():
+            win_percent = await session.get(WinPercent, best_win_percent.win_percent_id)
+            if win_percent and (await session.exec(select(WinMessage.id).where(WinMessage.win_photo_id == win_percent.win_photo_id))).first():
+                return win_percent
+
+        query = (
+            select(WinPercent)
+            .join(WinMessage, WinPercent.win_photo_id == WinMessage.win_photo_id)  # type: ignore
+            .where(WinPercent.created_at >= get_best_win_period_start())
+            .order_by(WinPercent.win_percent.desc())
+        )
+
+        return (await session.exec(query)).first()
+
+
+async def get_win_messages(win_photo_id: str) -> Iterable[WinMessage]:
+    query = select(WinMessage).where(WinMessage.win_photo_id == win_photo_id)
+
+    async with new_session() as session:
+        return (await session.exec(query)).all()
+
+
+async def save_job(job: Job) -> Job:
+    async with new_session() as session:
+        session.add(job)
+        await session.commit()
+
+    return job
+
+
+async def get_due_jobs() -> Iterable[Job]:
     query = (
-        select(WinPercent)
-        .join(WinMessage, WinPercent.win_photo_id == WinMessage.win_photo_id)  # type: ignore
-        .where(WinPercent.created_at >= yesterday)
-        .order_by(WinPercent.win_percent.desc())
+        select(Job)
+        .where(Job.is_done == False, Job.run_at <= datetime.now(timezone.utc))  # noqa: E712
+        .order_by(Job.run_at)
     )
 
-    return session.exec(query).first()
+    async with new_session() as session:
+        return (await session.exec(query)).all()
 
 
-def save_win_message(win_message: WinMessage) -> WinMessage:
-    session.add(win_message)
-    session.commit()
-    return win_message
+async def get_next_job() -> Optional[Job]:
+    query = select(Job).where(Job.is_done == False).order_by(Job.run_at)  # noqa: E712
+    async with new_session() as session:
+        return (await session.exec(query)).first()
 
 
-def get_win_messages(win_photo_id: str) -> Iterable[WinMessage]:
-    query = select(WinMessage).where(WinMessage.win_photo_id == win_photo_id)
-    return session.exec(query).all()
+async def get_deliveries(post_id: int, channel_id: int) -> dict[str, Delivery]:
+    query = select(Delivery).where(Delivery.post_id == post_id, Delivery.channel_id == channel_id)
+
+    async with new_session() as session:
+        return {delivery.step: delivery for delivery in (await session.exec(query)).all()}
+
+
+async def save_delivery(delivery: Delivery, *related_rows: SQLModel) -> Delivery:
+    async with new_session() as session:
+        session.add(delivery)
+        session.add_all(related_rows)
+        await session.commit()
+
+    return delivery
+
+
+async def count_deliveries(post_id: int, step: str) -> int:
+    query = select(func.count()).select_from(Delivery).where(Delivery.post_id == post_id, Delivery.step == step)
+
+    async with new_session() as session:
+        return (await session.exec(query)).one()
+
+
+async def save_completion_metric(completion_metric: CompletionMetric) -> CompletionMetric:
+    async with new_session() as session:
+        session.add(completion_metric)
+        await session.commit()
+
+    return completion_metric
+
+
+async def get_completion_metrics(since: datetime) -> Iterable[CompletionMetric]:
+    query = select(CompletionMetric).where(CompletionMetric.created_at >= since)
+
+    async with new_session() as session:
+        return (await session.exec(query)).all()
+
+
+async def get_storage_value(key: str) -> Any:
+    async with new_session() as session:
+        storage_record = await session.get(StorageRecord, key)
+
+    return json.loads(storage_record.value_json) if storage_record else None
+
+
+async def set_storage_value(key: str, value: Any):
+    async with new_session() as session:
+        if value is None:
+            await session.exec(delete(StorageRecord).where(StorageRecord.key == key))  # type: ignore
+            await session.commit()
+            return
+
+        storage_record = StorageRecord(key=key, value_json=json.dumps(value))
+        await session.merge(storage_record)
+        try:
+            await session.commit()
+        except IntegrityError:
+            await session.rollback()  # the key was created concurrently, retry as an update
+            await session.merge(storage_record)
+            await session.commit()
+
+
+async def get_expired_rows(model: type[BaseModel], expired_at: datetime, limit: int, *conditions) -> list[BaseModel]:
+    query = (
+        select(model)
+        .where(model.created_at < expired_at, *conditions)
+        .order_by(model.id)
+        .limit(limit)
+    )
+
+    async with new_session() as session:
+        return list((await session.exec(query)).all())
+
+
+async def compact_rows(model: type[BaseModel], rows: list[BaseModel], daily_aggregates: list[DailyAggregate]):
+    async with new_session() as session:
+        for daily_aggregate in daily_aggregates:
+            query = select(DailyAggregate).where(DailyAggregate.table_name == daily_aggregate.table_name, DailyAggregate.day == daily_aggregate.day)
+            existing_aggregate = (await session.exec(query)).first()
+
+            if existing_aggregate:
+                existing_aggregate.row_count += daily_aggregate.row_count
+                existing_aggregate.value_sum += daily_aggregate.value_sum
+                if daily_aggregate.value_max is not None:
+                    existing_aggregate.value_max = max(existing_aggregate.value_max or daily_aggregate.value_max, daily_aggregate.value_max)
+                session.add(existing_aggregate)
+            else:
+                session.add(daily_aggregate)
+
+        await session.exec(delete(model).where(model.id.in_([row.id for row in rows])))  # type: ignore
+        await session.commit()
+
+
+async def vacuum_database(pages: int):
+    async with engine.connect() as connection:
+        connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+
+        auto_vacuum = (await connection.execute(text("PRAGMA auto_vacuum"))).scalar()
+        if auto_vacuum != 2:
+            await connection.execute(text("PRAGMA auto_vacuum=INCREMENTAL"))
+            await connection.execute(text("VACUUM"))
+        else:
+            await connection.execute(text(f"PRAGMA incremental_vacuum({pages})"))
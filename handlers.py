@@ -1,14 +1,16 @@
 import asyncio
+import logging
+import math
 import random
 import re
-from contextlib import suppress
-from datetime import date
+from collections import defaultdict
+from contextlib import asynccontextmanager, suppress
+from datetime import date, datetime, timedelta, timezone
 from enum import Enum
+from typing import Awaitable, Callable, Optional
 
-from aiogram import Router, Bot, F
-from aiogram.client.default import DefaultBotProperties
-from aiogram.enums import ParseMode
-from aiogram.exceptions import TelegramBadRequest
+from aiogram import Router, F
+from aiogram.exceptions import TelegramBadRequest, TelegramAPIError
 from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, InputMediaPhoto, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, ForceReply, ReplyKeyboardRemove
@@ -17,8 +19,15 @@ from aiogram.utils.deep_linking import create_deep_link
 import chatgpt
 import config
 import database
+import jobs
+import metrics
+import sender
+import translations
+from assembler import PostAssembler, PostBundle
 from callbacks import *
 from config import *
+from container import get_app
+from workqueue import WorkQueue
 
 
 class State(Enum):
@@ -27,125 +36,274 @@ class State(Enum):
     WAITING_FOR_WINS2 = 3
 
 
-bot = Bot(BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 router = Router()
+router.message.outer_middleware(metrics.UpdateMetricsMiddleware())
+router.channel_post.outer_middleware(metrics.UpdateMetricsMiddleware())
+router.callback_query.outer_middleware(metrics.UpdateMetricsMiddleware())
 
-post_data = {}
+post_assembler = PostAssembler()
 wins_photo_ids = []
 
 current_state = State.WAITING_FOR_POST
-required_keys = ['chart_photo_id', 'stats_text', 'stats_file_id', 'win_photo_id']
 
-state = config.load_state()
 
+async def sync_shared_state(handler, event, data):
+    await get_app().sync_state()
+    return await handler(event, data)
 
-def get_text_length() -> int:
+
+router.message.outer_middleware(sync_shared_state)
+router.channel_post.outer_middleware(sync_shared_state)
+router.callback_query.outer_middleware(sync_shared_state)
+
+
+def get_channel_lock(channel: config.Channel):
+    return get_app().store.lock(f'channel:{channel.channel_id}')
+
+
+async def get_text_length() -> int:
     today = date.today().isoformat()
-    if state.last_600_usage_date == today:
+    if get_app().state.last_600_usage_date == today:
         lengths, weights = zip(*((length, weight) for length, weight in TEXT_LENGTHS.items() if length != 600))
     else:
         lengths, weights = zip(*TEXT_LENGTHS.items())
 
     text_length = random.choices(lengths, weights)[0]
     if text_length == 600:
-        state.last_600_usage_date = today
-        config.save_state(state)
+        await get_app().save_state(last_600_usage_date=today)
 
     return text_length
 
 
-async def generate_post():
-    if not all(key in post_data for key in required_keys):
-        post_data.clear()
+async def save_ingestion_state():
+    await get_app().store.set('ingestion', {
+        'post_bundles': post_assembler.dump(),
+        'wins_photo_ids': wins_photo_ids,
+        'current_state': current_state.name
+    })
+
+
+async def load_ingestion_state():
+    global current_state
+
+    ingestion_state = await get_app().store.get('ingestion')
+    if not ingestion_state:
+        return
+
+    post_assembler.bundles.clear()
+    post_assembler.load(ingestion_state.get('post_bundles', []))
+    wins_photo_ids[:] = ingestion_state['wins_photo_ids']
+    current_state = State[ingestion_state['current_state']]
+
+
+@asynccontextmanager
+async def shared_ingestion_state():
+    async with get_app().store.lock('ingestion'):
+        if get_app().store.is_shared:
+            await load_ingestion_state()
+
+        yield
+        await save_ingestion_state()
+
+
+async def restore_ingestion_state():
+    await load_ingestion_state()
+    async with shared_ingestion_state():
+        post_assembler.expire_bundles()
+
+    for bundle in post_assembler.get_complete_bundles():
+        generation_queue.put(bundle.correlation_id, bundle)
+
+
+async def generate_post(bundle: PostBundle):
+    if not await get_app().store.claim(f'bundle:{bundle.correlation_id}', ASSEMBLY_TIMEOUT):
         return
 
+    await get_app().sync_state()
+
     stats_message_id = None
-    if state.moderation_enabled:
-        stats_message = await bot.send_message(BOT_OWNER_ID, post_data['stats_text'])
+    draft_message = None
+    if get_app().state.moderation_enabled:
+        stats_message = await get_app().bot.send_message(BOT_OWNER_ID, bundle.parts['stats_text'])
         stats_message_id = stats_message.message_id
+        draft_message = sender.DraftMessage(get_app().bot, BOT_OWNER_ID, reply_to_message_id=stats_message_id)
+
+    with metrics.PIPELINE_STAGE_DURATION.time(stage='generate'):
+        generated_text = await chatgpt.generate_text(
+            bundle.parts['stats_text'], await get_text_length(),
+            on_progress=draft_message.update if draft_message else None
+        )
 
-    post = database.save_post(database.Post(
-        stats_text=post_data['stats_text'],
-        generated_text=chatgpt.generate_text(post_data['stats_text'], get_text_length()),
-        chart_photo_id=post_data['chart_photo_id'],
-        stats_file_id=post_data['stats_file_id'],
-        win_photo_id=post_data['win_photo_id'],
+    post = await database.save_post(database.Post(
+        stats_text=bundle.parts['stats_text'],
+        generated_text=generated_text,
+        chart_photo_id=bundle.parts['chart_photo_id'],
+        stats_file_id=bundle.parts['stats_file_id'],
+        win_photo_id=bundle.parts['win_photo_id'],
         stats_message_id=stats_message_id,
     ))
-    post_data.clear()
+    async with shared_ingestion_state():
+        post_assembler.remove_bundle(bundle.correlation_id)
 
-    if state.moderation_enabled:
-        await send_post_message(post)
+    if get_app().state.moderation_enabled:
+        await send_post_message(post, draft_message.message_id if draft_message else None)
     else:
         await publish_posts(post)
 
 
-async def send_post_message(post: database.Post):
+async def drop_post_bundle(bundle: PostBundle):
+    async with shared_ingestion_state():
+        post_assembler.remove_bundle(bundle.correlation_id)
+
+
+generation_queue = WorkQueue(
+    'Generation', generate_post,
+    maxsize=GENERATION_QUEUE_SIZE,
+    workers=GENERATION_WORKERS,
+    drop_oldest=GENERATION_QUEUE_DROP_OLDEST,
+    on_drop=drop_post_bundle
+)
+metrics.QUEUE_DEPTH.set_function(lambda: len(post_assembler.bundles), queue='Assembly')
+
+
+async def send_post_message(post: database.Post, draft_message_id: Optional[int] = None):
     reply_markup = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text=PUBLISH_POST_BUTTON, callback_data=PublishPost(post_id=post.id).pack())],
         [InlineKeyboardButton(text=EDIT_POST_BUTTON, callback_data=EditPost(post_id=post.id).pack())],
         [InlineKeyboardButton(text=DELETE_POST_BUTTON, callback_data=DeletePost(post_id=post.id).pack())]
     ])
 
+    translations.pretranslate_post(post.id, post.generated_text)
+
+    if draft_message_id and not post.text_voice_id:
+        try:
+            await get_app().bot.edit_message_text(post.generated_text, chat_id=BOT_OWNER_ID, message_id=draft_message_id, reply_markup=reply_markup)
+            return
+        except TelegramAPIError:
+            with suppress(TelegramAPIError):
+                await get_app().bot.delete_message(BOT_OWNER_ID, draft_message_id)
+
     if post.text_voice_id:
-        await bot.send_voice(BOT_OWNER_ID, post.text_voice_id, caption=post.generated_text, reply_markup=reply_markup, reply_to_message_id=post.stats_message_id)
+        await get_app().bot.send_voice(BOT_OWNER_ID, post.text_voice_id, caption=post.generated_text, reply_markup=reply_markup, reply_to_message_id=post.stats_message_id)
     else:
-        await bot.send_message(BOT_OWNER_ID, post.generated_text, reply_markup=reply_markup, reply_to_message_id=post.stats_message_id)
+        await get_app().bot.send_message(BOT_OWNER_ID, post.generated_text, reply_markup=reply_markup, reply_to_message_id=post.stats_message_id)
 
 
 async def publish_posts(post: database.Post):
-    chart_messages = {}
+    with metrics.PIPELINE_STAGE_DURATION.time(stage='translate'):
+        await translations.get_post_translations(post.id, post.generated_text)
 
     for channel in LANGUAGE_CHANNELS:
-        chart_messages[channel.channel_id] = await publish_post(post, channel)
-        await asyncio.sleep(1)
+        await jobs.schedule_job('publish_post', 0, post_id=post.id, channel_id=channel.channel_id)
+
+
+async def publish_to_channels(*publish_coroutines) -> list:
+    results = await asyncio.gather(*publish_coroutines, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logging.error("Channel publishing failed", exc_info=result)
+
+    return [result for result in results if not isinstance(result, Exception)]
+
+
+async def deliver(
+    post: database.Post,
+    channel: config.Channel,
+    deliveries: dict[str, database.Delivery],
+    step: str,
+    send: Callable[[], Awaitable[Message]],
+    get_related_rows: Optional[Callable[[Message], list]] = None
+) -> int:
+    if step not in deliveries:
+        message = await send()
+        deliveries[step] = await database.save_delivery(
+            database.Delivery(post_id=post.id, channel_id=channel.channel_id, step=step, message_id=message.message_id),
+            *(get_related_rows(message) if get_related_rows else ())
+        )
 
-    await asyncio.sleep(180)
+    return deliveries[step].message_id
 
-    for channel in LANGUAGE_CHANNELS:
-        await publish_post_win(post, channel, chart_messages[channel.channel_id])
-        await asyncio.sleep(1)
 
+@jobs.job_handler('publish_post')
+async def publish_post_job(post_id: int, channel_id: int):
+    post = await database.get_post(post_id)
+    channel = LANGUAGE_CHANNELS_BY_ID.get(channel_id)
+    if not post or not channel:
+        return
 
-async def publish_post(post: database.Post, channel: config.Channel):
-    if channel.is_default:
-        translated_text = post.generated_text
-    else:
-        translated_text = chatgpt.translate_text(channel.language, channel.language_note, post.generated_text)
+    translated_text = await translations.translate_text(channel, post.generated_text)
 
-    if not post.text_voice_id:
-        chart_message = await bot.send_photo(channel.channel_id, post.chart_photo_id, caption=translated_text, reply_to_message_id=channel.main_topic_id)
-    else:
-        chart_message = await bot.send_photo(channel.channel_id, post.chart_photo_id, reply_to_message_id=channel.main_topic_id)
-        await bot.send_voice(channel.channel_id, post.text_voice_id, caption=translated_text, reply_to_message_id=chart_message.message_id)
+    async with get_channel_lock(channel):
+        deliveries = await database.get_deliveries(post.id, channel.channel_id)
+        with metrics.PUBLISH_DURATION.time(channel=channel.language, step='chart'):
+            await publish_post_chart(post, channel, translated_text, deliveries)
 
-    await bot.send_document(channel.channel_id, post.stats_file_id, reply_to_message_id=channel.main_topic_id)
+    if 'win' not in deliveries:
+        charted_at = deliveries['file'].created_at.replace(tzinfo=timezone.utc)
+        win_delay = POST_WIN_DELAY - (datetime.now(timezone.utc) - charted_at).total_seconds()
+        await jobs.schedule_job('publish_post_win', max(win_delay, 0), post_id=post.id, channel_id=channel.channel_id)
 
-    post.is_published = True
-    database.save_post(post)
 
-    return chart_message
+async def publish_post_chart(post: database.Post, channel: config.Channel, translated_text: str, deliveries: dict[str, database.Delivery]):
+    chart_message_id = await deliver(post, channel, deliveries, 'chart', lambda: get_app().bot.send_photo(
+        channel.channel_id, post.chart_photo_id, caption=None if post.text_voice_id else translated_text, reply_to_message_id=channel.main_topic_id
+    ))
+
+    if post.text_voice_id:
+        await deliver(post, channel, deliveries, 'voice', lambda: get_app().bot.send_voice(
+            channel.channel_id, post.text_voice_id, caption=translated_text, reply_to_message_id=chart_message_id
+        ))
 
+    await deliver(post, channel, deliveries, 'file', lambda: get_app().bot.send_document(
+        channel.channel_id, post.stats_file_id, reply_to_message_id=channel.main_topic_id
+    ))
 
-async def publish_post_win(post: database.Post, channel: config.Channel, chart_message):
-    await bot.send_message(channel.channel_id, random.choice(WIN_EMOJIS), reply_to_message_id=channel.main_topic_id)
-    win_message = await bot.send_photo(channel.channel_id, post.win_photo_id, reply_to_message_id=chart_message.message_id)
 
-    database.save_win_message(
-        database.WinMessage(
+@jobs.job_handler('publish_post_win')
+async def publish_post_win_job(post_id: int, channel_id: int):
+    post = await database.get_post(post_id)
+    channel = LANGUAGE_CHANNELS_BY_ID.get(channel_id)
+    if not post or not channel:
+        return
+
+    async with get_channel_lock(channel):
+        deliveries = await database.get_deliveries(post.id, channel.channel_id)
+        with metrics.PUBLISH_DURATION.time(channel=channel.language, step='win'):
+            await publish_post_win(post, channel, deliveries, deliveries['chart'].message_id)
+
+    if not post.is_published and await database.count_deliveries(post.id, 'win') >= len(LANGUAGE_CHANNELS):
+        post.is_published = True
+        await database.save_post(post)
+
+
+async def publish_post_win(post: database.Post, channel: config.Channel, deliveries: dict[str, database.Delivery], chart_message_id: int):
+    await deliver(post, channel, deliveries, 'win_emoji', lambda: get_app().bot.send_message(
+        channel.channel_id, random.choice(WIN_EMOJIS), reply_to_message_id=channel.main_topic_id
+    ))
+
+    await deliver(
+        post, channel, deliveries, 'win',
+        lambda: get_app().bot.send_photo(channel.channel_id, post.win_photo_id, reply_to_message_id=chart_message_id),
+        lambda win_message: [database.WinMessage(
             channel_id=channel.channel_id,
             win_photo_id=post.win_photo_id,
             win_message_id=win_message.message_id,
             win_message_url=win_message.get_url(),
-        )
+        )]
     )
 
 
-async def generate_wins_post():
-    wins_post = database.save_wins_post(database.WinsPost(win_photo_ids=wins_photo_ids))
+async def generate_wins_post() -> database.WinsPost:
+    wins_post = await database.save_wins_post(database.WinsPost(win_photo_ids=wins_photo_ids))
     wins_photo_ids.clear()
 
-    if state.moderation_enabled:
+    return wins_post
+
+
+async def submit_wins_post(wins_post: database.WinsPost):
+    await get_app().sync_state()
+
+    if get_app().state.moderation_enabled:
         await send_wins_post_message(wins_post)
     else:
         await publish_wins_posts(wins_post)
@@ -157,85 +315,113 @@ async def send_wins_post_message(wins_post: database.WinsPost):
         [InlineKeyboardButton(text=DELETE_POST_BUTTON, callback_data=DeleteWinsPost(post_id=wins_post.id).pack())]
     ])
 
-    total_photos = len(wins_post.win_photo_ids)
-    for i in range(0, total_photos, 10):
-        win_photos = [InputMediaPhoto(media=photo_id) for photo_id in wins_post.win_photo_ids[i:i + 10]]
-        win_photos_messages = await bot.send_media_group(BOT_OWNER_ID, win_photos)
+    win_photos_messages = []
+    for win_photo_ids in plan_wins_chunks(wins_post.win_photo_ids):
+        win_photos_messages = await get_app().bot.send_media_group(BOT_OWNER_ID, [InputMediaPhoto(media=photo_id) for photo_id in win_photo_ids])
+
+    if win_photos_messages:
+        await win_photos_messages[-1].reply(WINS_POST_TEXT, reply_markup=reply_markup)
 
-        if i + 10 >= total_photos:
-            await win_photos_messages[-1].reply(WINS_POST_TEXT, reply_markup=reply_markup)
+
+def plan_wins_chunks(win_photo_ids: list[str]) -> list[list[str]]:
+    return [win_photo_ids[i:i + WINS_MEDIA_GROUP_SIZE] for i in range(0, len(win_photo_ids), WINS_MEDIA_GROUP_SIZE)]
 
 
 async def publish_wins_posts(wins_post: database.WinsPost):
-    for channel in LANGUAGE_CHANNELS:
-        await publish_wins_post(wins_post, channel)
-        await asyncio.sleep(1)
+    wins_chunks = plan_wins_chunks(wins_post.win_photo_ids)
+    with metrics.PIPELINE_STAGE_DURATION.time(stage='publish_wins'):
+        published_channels = await publish_to_channels(*(publish_wins_post(wins_post, wins_chunks, channel) for channel in LANGUAGE_CHANNELS))
 
+    if len(published_channels) == len(LANGUAGE_CHANNELS):
+        wins_post.is_published = True
+        await database.save_wins_post(wins_post)
 
-async def publish_wins_post(wins_post: database.WinsPost, channel: config.Channel):
-    for i in range(0, len(wins_post.win_photo_ids), 10):
-        win_photos = [InputMediaPhoto(media=photo_id) for photo_id in wins_post.win_photo_ids[i:i + 10]]
-        win_messages = await bot.send_media_group(channel.channel_id, win_photos, reply_to_message_id=channel.main_topic_id)
 
-        for win_photo_id, win_message in zip(wins_post.win_photo_ids, win_messages):
-            database.save_win_message(database.WinMessage(
-                channel_id=channel.channel_id,
-                win_photo_id=win_photo_id,
-                win_message_id=win_message.message_id,
-                win_message_url=win_message.get_url()
-            ))
+async def publish_wins_post(wins_post: database.WinsPost, wins_chunks: list[list[str]], channel: config.Channel) -> config.Channel:
+    async with get_channel_lock(channel):
+        deliveries = await database.get_deliveries(wins_post.id, channel.channel_id)
+        with metrics.PUBLISH_DURATION.time(channel=channel.language, step='wins'):
+            await publish_wins_post_photos(wins_post, wins_chunks, channel, deliveries)
+
+    return channel
+
+
+async def publish_wins_post_photos(wins_post: database.WinsPost, wins_chunks: list[list[str]], channel: config.Channel, deliveries: dict[str, database.Delivery]):
+    for i, win_photo_ids in enumerate(wins_chunks):
+        step = f'wins_post:{i}'  # wins posts share the ledger with posts, the step prefix keeps their ids apart
+        if step in deliveries:
+            continue
 
-    wins_post.is_published = True
-    database.save_wins_post(wins_post)
+        win_photos = [InputMediaPhoto(media=photo_id) for photo_id in win_photo_ids]
+        sent_messages = await get_app().bot.send_media_group(channel.channel_id, win_photos, reply_to_message_id=channel.main_topic_id)
+
+        deliveries[step] = await database.save_delivery(
+            database.Delivery(post_id=wins_post.id, channel_id=channel.channel_id, step=step, message_id=sent_messages[0].message_id),
+            *(
+                database.WinMessage(
+                    channel_id=channel.channel_id,
+                    win_photo_id=win_photo_id,
+                    win_message_id=sent_message.message_id,
+                    win_message_url=sent_message.get_url()
+                )
+                for win_photo_id, sent_message in zip(win_photo_ids, sent_messages)
+            )
+        )
 
 
 @router.channel_post(F.chat.id == WATCH_CHANNEL_ID)
 async def handle_channel_post(message: Message):
     global current_state
 
-    if message.text and '#stat' in message.text:
-        post_data['stats_text'] = message.text.replace('#stat', '')
+    correlation_id = post_assembler.get_correlation_id(message)
+    completed_bundles = []
 
-    if message.caption:
-        if '#chart' in message.caption:
-            post_data['chart_photo_id'] = message.photo[-1].file_id
+    async with shared_ingestion_state():
+        if message.text and '#stat' in message.text:
+            stats_text = post_assembler.strip_correlation_tag(message.text.replace('#stat', ''))
+            completed_bundles.append(post_assembler.add_part(correlation_id, 'stats_text', stats_text, message.media_group_id))
 
-        if '#file' in message.caption:
-            post_data['stats_file_id'] = message.document.file_id
+        if message.caption:
+            if '#chart' in message.caption:
+                completed_bundles.append(post_assembler.add_part(correlation_id, 'chart_photo_id', message.photo[-1].file_id, message.media_group_id))
 
-        if '#win' in message.caption:
-            post_data['win_photo_id'] = message.photo[-1].file_id
+            if '#file' in message.caption:
+                completed_bundles.append(post_assembler.add_part(correlation_id, 'stats_file_id', message.document.file_id, message.media_group_id))
 
-            win_percent_match = re.search(r'(\d+(\.\d+)?)%', message.caption)
-            win_percent = int(win_percent_match.group(1))
+            if '#win' in message.caption:
+                win_percent_match = re.search(r'(\d+(\.\d+)?)%', message.caption)
+                win_percent = int(win_percent_match.group(1))
 
-            database.save_win_percent(database.WinPercent(
-                win_percent=win_percent,
-                win_photo_id=message.photo[-1].file_id
-            ))
+                await database.save_win_percent(database.WinPercent(
+                    win_percent=win_percent,
+                    win_photo_id=message.photo[-1].file_id
+                ))
 
-            if current_state == State.WAITING_FOR_POST and state.generation_enabled:
-                current_state = State.WAITING_FOR_WINS1
-                await generate_post()
+                if current_state == State.WAITING_FOR_POST and get_app().state.generation_enabled:
+                    current_state = State.WAITING_FOR_WINS1
+                    completed_bundles.append(post_assembler.add_part(correlation_id, 'win_photo_id', message.photo[-1].file_id, message.media_group_id))
 
-            elif win_percent >= WIN_BIG_PERCENT and state.generation_enabled:
-                await generate_post()
+                elif win_percent >= WIN_BIG_PERCENT and get_app().state.generation_enabled:
+                    completed_bundles.append(post_assembler.add_part(correlation_id, 'win_photo_id', message.photo[-1].file_id, message.media_group_id))
 
-            elif current_state in (State.WAITING_FOR_WINS1, State.WAITING_FOR_WINS2) or not state.generation_enabled:
-                wins_photo_ids.append(message.photo[-1].file_id)
+                elif current_state in (State.WAITING_FOR_WINS1, State.WAITING_FOR_WINS2) or not get_app().state.generation_enabled:
+                    wins_photo_ids.append(message.photo[-1].file_id)
 
-        if '#promo' in message.caption:
-            for channel in LANGUAGE_CHANNELS:
-                await message.copy_to(
-                    channel.channel_id,
-                    caption=message.caption.replace('#promo', ''),
-                    reply_to_message_id=channel.main_topic_id
-                )
+    if message.caption and '#promo' in message.caption:
+        for channel in LANGUAGE_CHANNELS:
+            await message.copy_to(
+                channel.channel_id,
+                caption=message.caption.replace('#promo', ''),
+                reply_to_message_id=channel.main_topic_id
+            )
+
+    for bundle in filter(None, completed_bundles):
+        generation_queue.put(bundle.correlation_id, bundle)
 
 
 @router.callback_query(PublishPost.filter())
 async def publish_post_callback(callback: CallbackQuery, state: FSMContext, callback_data: PublishPost):
-    post = database.get_post(callback_data.post_id)
+    post = await database.get_post(callback_data.post_id)
     if not post or post.is_published:
         return
 
@@ -247,7 +433,7 @@ async def publish_post_callback(callback: CallbackQuery, state: FSMContext, call
 
 @router.callback_query(EditPost.filter())
 async def edit_post_callback(callback: CallbackQuery, state: FSMContext, callback_data: EditPost):
-    post = database.get_post(callback_data.post_id)
+    post = await database.get_post(callback_data.post_id)
     if not post:
         return
 
@@ -259,9 +445,10 @@ async def edit_post_callback(callback: CallbackQuery, state: FSMContext, callbac
 
 @router.callback_query(DeletePost.filter())
 async def delete_post_callback(callback: CallbackQuery, state: FSMContext, callback_data: DeletePost):
-    post = database.get_post(callback_data.post_id)
+    post = await database.get_post(callback_data.post_id)
     if post:
-        database.delete_post(post)
+        translations.discard_pretranslation(post.id)
+        await database.delete_post(post)
 
     await state.clear()
     await callback.message.delete()
@@ -271,7 +458,7 @@ async def delete_post_callback(callback: CallbackQuery, state: FSMContext, callb
 
 @router.callback_query(PublishWinsPost.filter())
 async def publish_wins_post_callback(callback: CallbackQuery, state: FSMContext, callback_data: PublishWinsPost):
-    wins_post = database.get_wins_post(callback_data.post_id)
+    wins_post = await database.get_wins_post(callback_data.post_id)
     if not wins_post or wins_post.is_published:
         return
 
@@ -283,9 +470,9 @@ async def publish_wins_post_callback(callback: CallbackQuery, state: FSMContext,
 
 @router.callback_query(DeleteWinsPost.filter())
 async def delete_wins_post_callback(callback: CallbackQuery, state: FSMContext, callback_data: DeleteWinsPost):
-    post = database.get_wins_post(callback_data.post_id)
+    post = await database.get_wins_post(callback_data.post_id)
     if post:
-        database.delete_wins_post(post)
+        await database.delete_wins_post(post)
 
     await state.clear()
     await callback.message.delete()
@@ -296,12 +483,12 @@ async def delete_wins_post_callback(callback: CallbackQuery, state: FSMContext,
 @router.message(PostState.edit_post)
 async def edit_post_handler(message: Message, state: FSMContext):
     data = await state.get_data()
-    post = database.get_post(data['post_id'])
+    post = await database.get_post(data['post_id'])
 
     with suppress(Exception):
         await message.delete()
-        await bot.delete_message(message.chat.id, data['post_message_id'])
-        await bot.delete_message(message.chat.id, data['edit_message_id'])
+        await get_app().bot.delete_message(message.chat.id, data['post_message_id'])
+        await get_app().bot.delete_message(message.chat.id, data['edit_message_id'])
 
     if not post:
         await state.clear()
@@ -317,7 +504,7 @@ async def edit_post_handler(message: Message, state: FSMContext):
         await message.answer(INVALID_EDIT_TEXT, reply_markup=ForceReply())
         return
 
-    database.save_post(post)
+    await database.save_post(post)
 
     await state.clear()
     await send_post_message(post)
@@ -331,34 +518,70 @@ async def admin_command(message: Message):
     await message.answer(
         ADMIN_SETTINGS_TEXT,
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=MODERATION_BUTTON.format(status='✅' if state.moderation_enabled else '❌'), callback_data=ToggleModeration(enabled=state.moderation_enabled).pack())],
-            [InlineKeyboardButton(text=GENERATION_BUTTON.format(status='✅' if state.generation_enabled else '❌'), callback_data=ToggleGeneration(enabled=state.generation_enabled).pack())]
+            [InlineKeyboardButton(text=MODERATION_BUTTON.format(status='✅' if get_app().state.moderation_enabled else '❌'), callback_data=ToggleModeration(enabled=get_app().state.moderation_enabled).pack())],
+            [InlineKeyboardButton(text=GENERATION_BUTTON.format(status='✅' if get_app().state.generation_enabled else '❌'), callback_data=ToggleGeneration(enabled=get_app().state.generation_enabled).pack())]
         ])
     )
 
 
+def get_percentile(values: list[float], percentile: float) -> float:
+    values = sorted(values)
+    return values[max(math.ceil(len(values) * percentile) - 1, 0)]
+
+
+@router.message(Command('stats'))
+async def stats_command(message: Message):
+    if message.from_user.id != BOT_OWNER_ID:
+        return
+
+    completion_metrics = await database.get_completion_metrics(datetime.now(timezone.utc) - timedelta(days=STATS_DAYS))
+    if not completion_metrics:
+        await message.answer(NO_STATS_TEXT)
+        return
+
+    grouped_metrics = defaultdict(list)
+    for completion_metric in completion_metrics:
+        grouped_metrics[(completion_metric.prompt_type, completion_metric.language or '')].append(completion_metric)
+
+    stats_lines = [STATS_TEXT.format(days=STATS_DAYS)]
+    for (prompt_type, language), prompt_metrics in sorted(grouped_metrics.items()):
+        latencies = [metric.latency_ms for metric in prompt_metrics]
+
+        stats_lines.append(STATS_LINE_TEXT.format(
+            prompt_type=prompt_type,
+            language=language,
+            calls=len(prompt_metrics),
+            errors=sum(metric.outcome != 'ok' for metric in prompt_metrics),
+            p50=get_percentile(latencies, 0.5),
+            p95=get_percentile(latencies, 0.95),
+            prompt_tokens=sum(metric.prompt_tokens for metric in prompt_metrics),
+            completion_tokens=sum(metric.completion_tokens for metric in prompt_metrics),
+            cost=sum(chatgpt.get_completion_cost(metric) for metric in prompt_metrics)
+        ))
+
+    await message.answer('\n\n'.join(stats_lines))
+
+
 @router.callback_query(ToggleModeration.filter())
 async def toggle_moderation_callback(callback: CallbackQuery, callback_data: ToggleModeration):
-    state.moderation_enabled = not callback_data.enabled
-    config.save_state(state)
+    await get_app().save_state(moderation_enabled=not callback_data.enabled)
 
     await callback.message.edit_reply_markup(
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=MODERATION_BUTTON.format(status='✅' if state.moderation_enabled else '❌'), callback_data=ToggleModeration(enabled=state.moderation_enabled).pack())],
-            [InlineKeyboardButton(text=GENERATION_BUTTON.format(status='✅' if state.generation_enabled else '❌'), callback_data=ToggleGeneration(enabled=state.generation_enabled).pack())]
+            [InlineKeyboardButton(text=MODERATION_BUTTON.format(status='✅' if get_app().state.moderation_enabled else '❌'), callback_data=ToggleModeration(enabled=get_app().state.moderation_enabled).pack())],
+            [InlineKeyboardButton(text=GENERATION_BUTTON.format(status='✅' if get_app().state.generation_enabled else '❌'), callback_data=ToggleGeneration(enabled=get_app().state.generation_enabled).pack())]
         ])
     )
 
 
 @router.callback_query(ToggleGeneration.filter())
 async def toggle_requests_callback(callback: CallbackQuery, callback_data: ToggleGeneration):
-    state.generation_enabled = not callback_data.enabled
-    config.save_state(state)
+    await get_app().save_state(generation_enabled=not callback_data.enabled)
 
     await callback.message.edit_reply_markup(
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=MODERATION_BUTTON.format(status='✅' if state.moderation_enabled else '❌'), callback_data=ToggleModeration(enabled=state.moderation_enabled).pack())],
-            [InlineKeyboardButton(text=GENERATION_BUTTON.format(status='✅' if state.generation_enabled else '❌'), callback_data=ToggleGeneration(enabled=state.generation_enabled).pack())]
+            [InlineKeyboardButton(text=MODERATION_BUTTON.format(status='✅' if get_app().state.moderation_enabled else '❌'), callback_data=ToggleModeration(enabled=get_app().state.moderation_enabled).pack())],
+            [InlineKeyboardButton(text=GENERATION_BUTTON.format(status='✅' if get_app().state.generation_enabled else '❌'), callback_data=ToggleGeneration(enabled=get_app().state.generation_enabled).pack())]
         ])
     )
 
@@ -385,7 +608,7 @@ async def button_command(message: Message, command: CommandObject):
     )
 
     try:
-        await bot.edit_message_reply_markup(
+        await get_app().bot.edit_message_reply_markup(
             chat_id=f'@{chat_id}' if not chat_id.isdigit() else chat_id,
             message_id=message_id,
             reply_markup=reply_markup
@@ -399,20 +622,25 @@ async def button_command(message: Message, command: CommandObject):
 async def update_state():
     global current_state
 
-    if current_state == State.WAITING_FOR_WINS1:
-        current_state = State.WAITING_FOR_WINS2
-    elif current_state == State.WAITING_FOR_WINS2:
-        current_state = State.WAITING_FOR_POST
-        if wins_photo_ids:
-            await generate_wins_post()
+    wins_post = None
+    async with shared_ingestion_state():
+        if current_state == State.WAITING_FOR_WINS1:
+            current_state = State.WAITING_FOR_WINS2
+        elif current_state == State.WAITING_FOR_WINS2:
+            current_state = State.WAITING_FOR_POST
+            if wins_photo_ids:
+                wins_post = await generate_wins_post()
+
+    if wins_post:
+        await submit_wins_post(wins_post)
 
 
 async def send_best_win_percent():
-    best_win_percent = database.get_best_win_percent()
+    best_win_percent = await database.get_best_win_percent()
     if not best_win_percent:
         return
 
-    best_win_messages = database.get_win_messages(best_win_percent.win_photo_id)
+    best_win_messages = await database.get_win_messages(best_win_percent.win_photo_id)
     if not best_win_messages:
         return
 
@@ -426,24 +654,28 @@ async def send_best_win_percent():
             f'{win_message.created_at.strftime("%Y/%m/%d %H:%M")}</a>'
         )
 
-        await bot.copy_message(
+        await get_app().bot.copy_message(
             win_message.channel_id, win_message.channel_id, win_message.win_message_id,
             caption=best_win_caption, reply_to_message_id=channel.top_topic_id
         )
 
 
 async def send_message_links():
+    await get_app().sync_state()
+
     for channel in LANGUAGE_CHANNELS:
         if not channel.message_links:
             continue
 
-        current_index = state.current_link_index.get(channel.channel_id, 0)
+        current_index = get_app().state.current_link_index.get(channel.channel_id, 0)
         link_to_send = channel.message_links[current_index]
 
-        state.current_link_index[channel.channel_id] = (current_index + 1) % len(channel.message_links)
-        config.save_state(state)
+        await get_app().save_state(current_link_index={
+            **get_app().state.current_link_index,
+            channel.channel_id: (current_index + 1) % len(channel.message_links)
+        })
 
-        await bot.send_message(
+        await get_app().bot.send_message(
             channel.channel_id,
             link_to_send,
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[
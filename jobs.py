@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Awaitable
+
+import database
+from config import JOBS_POLL_INTERVAL, JOB_MAX_ATTEMPTS, JOB_RETRY_DELAY, JOB_CLAIM_BACKOFF, JOB_ERROR_BACKOFF, SHARED_LOCK_TIMEOUT
+from container import get_app
+
+job_handlers: dict[str, Callable[..., Awaitable]] = {}
+jobs_added = asyncio.Event()
+
+
+def job_handler(name: str):
+    def decorator(handler: Callable[..., Awaitable]):
+        job_handlers[name] = handler
+        return handler
+
+    return decorator
+
+
+async def schedule_job(name: str, delay: float, **payload) -> database.Job:
+    job = await database.save_job(database.Job(
+        name=name,
+        payload=payload,
+        run_at=datetime.now(timezone.utc) + timedelta(seconds=delay)
+    ))
+    jobs_added.set()
+
+    return job
+
+
+async def run_job(job: database.Job) -> bool:
+    if not await get_app().store.claim(f'job:{job.id}:{job.attempts}', SHARED_LOCK_TIMEOUT):
+        return False
+
+    try:
+        await job_handlers[job.name](**job.payload)
+        job.is_done = True
+    except Exception:
+        logging.exception("Job %s #%s failed", job.name, job.id)
+
+        job.attempts += 1
+        job.is_done = job.attempts >= JOB_MAX_ATTEMPTS
+        job.run_at = datetime.now(timezone.utc) + timedelta(seconds=JOB_RETRY_DELAY)
+
+    try:
+        await database.save_job(job)
+    except Exception:
+        logging.exception("Failed to save job %s #%s", job.name, job.id)
+
+    return True
+
+
+async def run_due_jobs() -> float:
+    results = await asyncio.gather(*(run_job(job) for job in await database.get_due_jobs()), return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logging.error("Job run failed", exc_info=result)
+
+    timeout = JOBS_POLL_INTERVAL
+    next_job = await database.get_next_job()
+    if next_job:
+        next_run_at = next_job.run_at.replace(tzinfo=timezone.utc)
+        timeout = min(timeout, max((next_run_at - datetime.now(timezone.utc)).total_seconds(), 0))
+
+    if not all(result is True for result in results):
+        timeout = max(timeout, JOB_CLAIM_BACKOFF)  # another worker is running a due job, or a claim failed
+
+    return timeout
+
+
+async def run_jobs():
+    while True:
+        jobs_added.clear()
+
+        try:
+            timeout = await run_due_jobs()
+        except Exception:
+            logging.exception("Job runner failed, retrying in %s seconds", JOB_ERROR_BACKOFF)
+            await asyncio.sleep(JOB_ERROR_BACKOFF)
+            continue
+
+        try:
+            await asyncio.wait_for(jobs_added.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
@@ -1,26 +1,127 @@
 import asyncio
 import logging
+import signal
 
 import aiocron
 from aiogram import Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.base import DefaultKeyBuilder
+from aiogram.fsm.storage.redis import RedisStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 
+import chatgpt
+import config
+import container
+import database
 import handlers
-from handlers import bot, router
+import jobs
+import metrics
+import retention
+from config import WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, METRICS_HOST, METRICS_PORT, REDIS_URL, REDIS_PREFIX
+from handlers import router
+from storage import SQLiteStorage
 
 
-async def main():
-    dispatcher = Dispatcher(storage=MemoryStorage())
+def create_storage():
+    if REDIS_URL:
+        return RedisStorage.from_url(REDIS_URL, key_builder=DefaultKeyBuilder(prefix=f'{REDIS_PREFIX}:fsm', with_destiny=True))
+
+    return SQLiteStorage()
+
+
+def create_dispatcher() -> Dispatcher:
+    dispatcher = Dispatcher(storage=create_storage())
     dispatcher.include_router(router)
+    dispatcher.startup.register(container.get_app().log_startup_timings)
+    dispatcher.shutdown.register(handlers.generation_queue.stop)
+    dispatcher.shutdown.register(chatgpt.close)
+    dispatcher.shutdown.register(container.get_app().close)
+    dispatcher.shutdown.register(database.close_database)
+    dispatcher.shutdown.register(config.flush_state)
+
+    return dispatcher
+
+
+def create_webhook_app(dispatcher: Dispatcher) -> web.Application:
+    app = web.Application()
+    bot = container.get_app().bot
+    SimpleRequestHandler(dispatcher=dispatcher, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dispatcher, bot=bot)
+
+    return app
+
+
+async def run_webhook(dispatcher: Dispatcher):
+    runner = web.AppRunner(create_webhook_app(dispatcher))
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+
+    await container.get_app().bot.set_webhook(
+        WEBHOOK_URL,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dispatcher.resolve_used_update_types(),
+        drop_pending_updates=not container.get_app().store.is_shared
+    )
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for stop_signal in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(stop_signal, stop_event.set)
+
+    try:
+        await stop_event.wait()
+    finally:
+        await runner.cleanup()
 
-    aiocron.crontab('*/30 * * * *', handlers.update_state)
-    aiocron.crontab('0 0 * * *', handlers.send_best_win_percent)
-    aiocron.crontab('0 12 * * *', handlers.send_message_links)
 
+async def run_polling(dispatcher: Dispatcher):
+    bot = container.get_app().bot
     await bot.delete_webhook(drop_pending_updates=True)
     await dispatcher.start_polling(bot, allowed_updates=dispatcher.resolve_used_update_types())
 
 
+def run_on_leader(cron_job):
+    async def run():
+        if container.get_app().store.is_leader:
+            await cron_job()
+
+    return run
+
+
+async def main():
+    if WEBHOOK_URL and not WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET must be set when WEBHOOK_URL is set, otherwise anyone can post updates to the webhook")
+
+    container.app = container.Container()
+    await container.app.init_database()
+    await handlers.restore_ingestion_state()
+
+    dispatcher = create_dispatcher()
+
+    aiocron.crontab('*/30 * * * *', run_on_leader(handlers.update_state))
+    aiocron.crontab('0 0 * * *', run_on_leader(handlers.send_best_win_percent))
+    aiocron.crontab('0 12 * * *', run_on_leader(handlers.send_message_links))
+    aiocron.crontab('30 3 * * *', run_on_leader(retention.run_retention))
+
+    if container.app.store.is_shared and not WEBHOOK_URL:
+        logging.warning("Shared store is configured without WEBHOOK_URL, only one worker can poll for updates")
+
+    metrics_runner = await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT)
+    leader_election_task = asyncio.create_task(container.app.store.run_leader_election())
+    jobs_task = asyncio.create_task(jobs.run_jobs())
+    handlers.generation_queue.start()
+
+    try:
+        if WEBHOOK_URL:
+            await run_webhook(dispatcher)
+        else:
+            await run_polling(dispatcher)
+    finally:
+        jobs_task.cancel()
+        leader_election_task.cancel()
+        await metrics_runner.cleanup()
+
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
     asyncio.run(main())
@@ -0,0 +1,175 @@
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod, Response
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject
+from aiohttp import web
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+registry: list["Metric"] = []
+
+
+def escape_label_value(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: dict[str, Any]) -> str:
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in labels.items()) + "}"
+
+
+class Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.values: dict[tuple, float] = {}
+        self.functions: dict[tuple, Callable[[], float]] = {}
+        registry.append(self)
+
+    def get_key(self, labels: dict[str, Any]) -> tuple:
+        return tuple(str(labels.get(label_name, "")) for label_name in self.label_names)
+
+    def set_function(self, function: Callable[[], float], **labels):
+        self.functions[self.get_key(labels)] = function
+
+    def collect(self) -> Iterator[tuple[str, dict[str, Any], float]]:
+        for key, value in self.values.items():
+            yield self.name, dict(zip(self.label_names, key)), value
+
+        for key, function in self.functions.items():
+            yield self.name, dict(zip(self.label_names, key)), function()
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(f"{name}{format_labels(labels)} {value}" for name, labels, value in self.collect())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.get_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    metric_type = "gauge"
+
+    def set(self, value: float, **labels):
+        self.values[self.get_key(labels)] = value
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = buckets
+        self.observations: dict[tuple, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        bucket_counts, totals = self.observations.setdefault(self.get_key(labels), ([0] * len(self.buckets), [0, 0.0]))
+        for i, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                bucket_counts[i] += 1
+
+        totals[0] += 1
+        totals[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def collect(self) -> Iterator[tuple[str, dict[str, Any], float]]:
+        for key, (bucket_counts, (count, total)) in self.observations.items():
+            labels = dict(zip(self.label_names, key))
+            for bucket, bucket_count in zip(self.buckets, bucket_counts):
+                yield f"{self.name}_bucket", {**labels, "le": bucket}, bucket_count
+
+            yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, count
+            yield f"{self.name}_count", labels, count
+            yield f"{self.name}_sum", labels, total
+
+
+UPDATE_DURATION = Histogram("bot_update_duration_seconds", "Time spent handling an update", ("event_type",))
+UPDATE_ERRORS = Counter("bot_update_errors_total", "Updates whose handler raised", ("event_type",))
+
+TELEGRAM_REQUEST_DURATION = Histogram("telegram_request_duration_seconds", "Telegram Bot API request duration", ("method",))
+TELEGRAM_ERRORS = Counter("telegram_errors_total", "Failed Telegram Bot API requests", ("method", "error"))
+TELEGRAM_RETRIES = Counter("telegram_retries_total", "Telegram requests retried after flood control", ("method",))
+
+CHATGPT_REQUEST_DURATION = Histogram("chatgpt_request_duration_seconds", "OpenAI completion duration", ("prompt_type", "outcome"))
+CHATGPT_TOKENS = Counter("chatgpt_tokens_total", "OpenAI tokens used", ("prompt_type", "kind"))
+
+DATABASE_QUERY_DURATION = Histogram("database_query_duration_seconds", "Database statement duration", ("statement",))
+DATABASE_COMMIT_DURATION = Histogram("database_commit_duration_seconds", "Database commit duration")
+
+QUEUE_DEPTH = Gauge("queue_depth", "Items waiting in a queue", ("queue",))
+QUEUE_EVENTS = Counter("queue_events_total", "Work queue events", ("queue", "event"))
+QUEUE_WAIT_DURATION = Histogram("queue_wait_seconds", "Time an item waited in a work queue", ("queue",))
+
+PIPELINE_STAGE_DURATION = Histogram("pipeline_stage_duration_seconds", "Duration of each #win to publish pipeline stage", ("stage",))
+PUBLISH_DURATION = Histogram("publish_duration_seconds", "Publish duration per channel", ("channel", "step"))
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]], event: TelegramObject, data: Dict[str, Any]) -> Any:
+        event_type = type(event).__name__
+        try:
+            with UPDATE_DURATION.time(event_type=event_type):
+                return await handler(event, data)
+        except Exception:
+            UPDATE_ERRORS.inc(event_type=event_type)
+            raise
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot, method: TelegramMethod[TelegramType]) -> Response[TelegramType]:
+        method_name = type(method).__name__
+        try:
+            with TELEGRAM_REQUEST_DURATION.time(method=method_name):
+                return await make_request(bot, method)
+        except Exception as error:
+            TELEGRAM_ERRORS.inc(method=method_name, error=type(error).__name__)
+            raise
+
+
+def reset():
+    for metric in registry:
+        metric.values.clear()
+        if isinstance(metric, Histogram):
+            metric.observations.clear()
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+
+    return runner
@@ -0,0 +1,71 @@
+import asyncio
+import gzip
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+import database
+from config import RETENTION_DAYS, RETENTION_BATCH_SIZE, RETENTION_VACUUM_PAGES, ARCHIVE_DIR
+
+RETAINED_MODELS = {
+    "winpercent": (database.WinPercent, None),
+    "winmessage": (database.WinMessage, None),
+    "post": (database.Post, None),
+    "winspost": (database.WinsPost, None),
+    "job": (database.Job, database.Job.is_done == True),  # noqa: E712
+    "completionmetric": (database.CompletionMetric, None),
+    "delivery": (database.Delivery, None)
+}
+
+
+def build_daily_aggregates(table_name: str, rows: list[database.BaseModel]) -> list[database.DailyAggregate]:
+    daily_aggregates = {}
+
+    for row in rows:
+        day = row.created_at.date().isoformat()
+        daily_aggregate = daily_aggregates.setdefault(day, database.DailyAggregate(table_name=table_name, day=day))
+        daily_aggregate.row_count += 1
+
+        if isinstance(row, database.WinPercent):
+            daily_aggregate.value_sum += row.win_percent
+            daily_aggregate.value_max = max(daily_aggregate.value_max or row.win_percent, row.win_percent)
+
+        if isinstance(row, database.CompletionMetric):
+            daily_aggregate.value_sum += row.prompt_tokens + row.completion_tokens
+
+    return list(daily_aggregates.values())
+
+
+def archive_rows(table_name: str, rows: list[database.BaseModel]):
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    filename = os.path.join(ARCHIVE_DIR, f"{table_name}-{datetime.now(timezone.utc):%Y%m%d}.jsonl.gz")
+
+    with gzip.open(filename, "at", encoding="utf-8") as file:
+        for row in rows:
+            file.write(row.model_dump_json() + "\n")
+
+
+async def compact_table(table_name: str, retention_days: int) -> int:
+    model, condition = RETAINED_MODELS[table_name]
+    expired_at = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    conditions = [condition] if condition is not None else []
+    compacted_rows = 0
+
+    while rows := await database.get_expired_rows(model, expired_at, RETENTION_BATCH_SIZE, *conditions):
+        await asyncio.to_thread(archive_rows, table_name, rows)
+        await database.compact_rows(model, rows, build_daily_aggregates(table_name, rows))
+        compacted_rows += len(rows)
+
+    return compacted_rows
+
+
+async def run_retention():
+    for table_name, retention_days in RETENTION_DAYS.items():
+        try:
+            compacted_rows = await compact_table(table_name, retention_days)
+            if compacted_rows:
+                logging.info("Compacted %s rows from %s", compacted_rows, table_name)
+        except Exception:
+            logging.exception("Retention failed for %s", table_name)
+
+    await database.vacuum_database(RETENTION_VACUUM_PAGES)
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter, TelegramAPIError
+from aiogram.methods import TelegramMethod, Response, SendMessage, SendPhoto, SendVoice, SendDocument, SendMediaGroup, SendAnimation, SendVideo, CopyMessage, ForwardMessage
+from aiogram.methods.base import TelegramType
+
+import metrics
+from config import TELEGRAM_GLOBAL_RATE, TELEGRAM_PRIVATE_CHAT_RATE, TELEGRAM_GROUP_CHAT_RATE, TELEGRAM_CHAT_BURST, TELEGRAM_MAX_RETRIES, DRAFT_EDIT_INTERVAL
+
+SEND_METHODS = (SendMessage, SendPhoto, SendVoice, SendDocument, SendMediaGroup, SendAnimation, SendVideo, CopyMessage, ForwardMessage)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, count: int = 1):
+        async with self.lock:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+                    continue
+
+                self.refill()
+                needed = min(count, self.capacity)  # a request larger than the burst waits for a full bucket and leaves it in debt
+                if self.tokens >= needed:
+                    self.tokens -= count
+                    return
+
+                await asyncio.sleep((needed - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class SendScheduler(BaseRequestMiddleware):
+    def __init__(self):
+        self.global_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_RATE)
+        self.chat_buckets: dict[int | str, TokenBucket] = {}
+
+    def get_chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        if chat_id not in self.chat_buckets:
+            is_private = isinstance(chat_id, int) and chat_id > 0
+            rate = TELEGRAM_PRIVATE_CHAT_RATE if is_private else TELEGRAM_GROUP_CHAT_RATE
+            self.chat_buckets[chat_id] = TokenBucket(rate, TELEGRAM_CHAT_BURST)
+
+        return self.chat_buckets[chat_id]
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot, method: TelegramMethod[TelegramType]) -> Response[TelegramType]:
+        if not isinstance(method, SEND_METHODS):
+            return await make_request(bot, method)
+
+        chat_bucket = self.get_chat_bucket(method.chat_id)
+        message_count = len(method.media) if isinstance(method, SendMediaGroup) else 1
+        for attempt in range(TELEGRAM_MAX_RETRIES):
+            await chat_bucket.acquire(message_count)
+            await self.global_bucket.acquire(message_count)
+
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as error:
+                if attempt == TELEGRAM_MAX_RETRIES - 1:
+                    raise
+
+                logging.warning("Flood control in chat %s, retrying in %s seconds", method.chat_id, error.retry_after)
+                metrics.TELEGRAM_RETRIES.inc(method=type(method).__name__)
+                chat_bucket.pause(error.retry_after)
+
+
+class DraftMessage:
+    def __init__(self, bot: Bot, chat_id: int, reply_to_message_id: Optional[int] = None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.reply_to_message_id = reply_to_message_id
+        self.message_id: Optional[int] = None
+        self.edited_at = 0.0
+
+    async def update(self, text: str):
+        if time.monotonic() - self.edited_at < DRAFT_EDIT_INTERVAL:
+            return
+
+        self.edited_at = time.monotonic()
+        try:
+            if self.message_id is None:
+                message = await self.bot.send_message(self.chat_id, text, parse_mode=None, reply_to_message_id=self.reply_to_message_id)
+                self.message_id = message.message_id
+            else:
+                await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message_id, parse_mode=None)
+        except TelegramRetryAfter as error:
+            logging.warning("Flood control on draft message, skipping updates for %s seconds", error.retry_after)
+            self.edited_at = time.monotonic() + error.retry_after
+        except TelegramAPIError as error:
+            logging.warning("Failed to update draft message: %s", error.message)
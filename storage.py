@@ -0,0 +1,26 @@
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType, KeyBuilder, DefaultKeyBuilder
+
+import database
+
+
+class SQLiteStorage(BaseStorage):
+    def __init__(self, key_builder: Optional[KeyBuilder] = None):
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await database.set_storage_value(self.key_builder.build(key, "state"), state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await database.get_storage_value(self.key_builder.build(key, "state"))
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await database.set_storage_value(self.key_builder.build(key, "data"), data or None)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return await database.get_storage_value(self.key_builder.build(key, "data")) or {}
+
+    async def close(self) -> None:
+        pass
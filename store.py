@@ -0,0 +1,108 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from typing import Any
+
+from redis.asyncio import Redis
+
+import database
+from config import REDIS_PREFIX, WORKER_ID, SHARED_LOCK_TIMEOUT, LEADER_LEASE_TTL
+
+RENEW_LEADERSHIP_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_LEADERSHIP_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class LocalStore:
+    is_shared = False
+
+    def __init__(self):
+        self.locks: dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self.is_leader = True
+
+    async def get(self, key: str) -> Any:
+        return await database.get_storage_value(key)
+
+    async def set(self, key: str, value: Any):
+        await database.set_storage_value(key, value)
+
+    def lock(self, name: str) -> asyncio.Lock:
+        return self.locks[name]
+
+    async def claim(self, key: str, ttl: int) -> bool:
+        return True
+
+    async def run_leader_election(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class RedisStore:
+    is_shared = True
+
+    def __init__(self, redis: Redis):
+        self.redis = redis
+        self.is_leader = False
+        self.renew_leadership = redis.register_script(RENEW_LEADERSHIP_SCRIPT)
+        self.release_leadership = redis.register_script(RELEASE_LEADERSHIP_SCRIPT)
+
+    @staticmethod
+    def get_key(*parts: str) -> str:
+        return ":".join((REDIS_PREFIX, *parts))
+
+    async def get(self, key: str) -> Any:
+        value_json = await self.redis.get(self.get_key("value", key))
+        return json.loads(value_json) if value_json else None
+
+    async def set(self, key: str, value: Any):
+        if value is None:
+            await self.redis.delete(self.get_key("value", key))
+        else:
+            await self.redis.set(self.get_key("value", key), json.dumps(value))
+
+    def lock(self, name: str):
+        return self.redis.lock(self.get_key("lock", name), timeout=SHARED_LOCK_TIMEOUT)
+
+    async def claim(self, key: str, ttl: int) -> bool:
+        return bool(await self.redis.set(self.get_key("claim", key), WORKER_ID, nx=True, ex=ttl))
+
+    async def elect_leader(self) -> bool:
+        leader_key = self.get_key("leader")
+        if await self.redis.set(leader_key, WORKER_ID, nx=True, ex=LEADER_LEASE_TTL):
+            return True
+
+        return bool(await self.renew_leadership(keys=[leader_key], args=[WORKER_ID, LEADER_LEASE_TTL]))
+
+    async def run_leader_election(self):
+        while True:
+            try:
+                is_leader = await self.elect_leader()
+            except Exception:
+                logging.exception("Leader election failed")
+                is_leader = False
+
+            if is_leader != self.is_leader:
+                logging.info("Worker %s %s leadership", WORKER_ID, "acquired" if is_leader else "lost")
+                self.is_leader = is_leader
+
+            await asyncio.sleep(LEADER_LEASE_TTL / 3)
+
+    async def close(self):
+        if self.is_leader:
+            await self.release_leadership(keys=[self.get_key("leader")], args=[WORKER_ID])
+            self.is_leader = False
+
+        await self.redis.aclose()
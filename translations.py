@@ -0,0 +1,130 @@
+import asyncio
+import hashlib
+import json
+import logging
+from contextlib import suppress
+from functools import partial
+from typing import Optional
+
+import chatgpt
+import config
+import database
+from config import LANGUAGE_CHANNELS, TRANSLATE_CONCURRENCY, TRANSLATE_BATCHED, CHATGPT_TRANSLATE_PROMPT, CHATGPT_BATCH_TRANSLATE_PROMPT, CHATGPT_SETTINGS
+
+semaphore = asyncio.Semaphore(TRANSLATE_CONCURRENCY)
+pretranslation_tasks: dict[int, tuple[str, asyncio.Task]] = {}
+prompt_version = hashlib.sha256(json.dumps([CHATGPT_TRANSLATE_PROMPT, CHATGPT_BATCH_TRANSLATE_PROMPT, CHATGPT_SETTINGS], sort_keys=True).encode()).hexdigest()
+
+
+def get_cache_key(channel: config.Channel, original_text: str) -> str:
+    key_data = [prompt_version, channel.language, channel.language_note, original_text]
+    return hashlib.sha256(json.dumps(key_data, ensure_ascii=False).encode()).hexdigest()
+
+
+async def get_cached_translation(channel: config.Channel, original_text: str) -> Optional[str]:
+    translation = await database.get_translation(get_cache_key(channel, original_text))
+    return translation.translated_text if translation else None
+
+
+async def cache_translation(channel: config.Channel, original_text: str, translated_text: str):
+    cache_key = get_cache_key(channel, original_text)
+    if not await database.get_translation(cache_key):
+        await database.save_translation(database.Translation(
+            cache_key=cache_key,
+            language=channel.language,
+            translated_text=translated_text
+        ))
+
+
+async def translate_text(channel: config.Channel, original_text: str) -> str:
+    if channel.is_default:
+        return original_text
+
+    translated_text = await get_cached_translation(channel, original_text)
+    if translated_text:
+        return translated_text
+
+    async with semaphore:
+        translated_text = await chatgpt.translate_text(channel.language, channel.language_note, original_text)
+
+    await cache_translation(channel, original_text, translated_text)
+    return translated_text
+
+
+async def translate_batch(channels: list[config.Channel], original_text: str) -> dict[int, str]:
+    try:
+        async with semaphore:
+            batch_texts = await chatgpt.translate_texts([(channel.language, channel.language_note) for channel in channels], original_text)
+    except Exception:
+        logging.exception("Batched translation failed")
+        return {}
+
+    translated_texts = {}
+    for channel in channels:
+        translated_text = batch_texts.get(channel.language) if isinstance(batch_texts, dict) else None
+        if isinstance(translated_text, str) and translated_text.strip():
+            translated_texts[channel.channel_id] = translated_text
+            await cache_translation(channel, original_text, translated_text)
+        else:
+            logging.warning("Batched translation is missing %s, falling back to a separate request", channel.language)
+
+    return translated_texts
+
+
+async def translate_post(original_text: str) -> dict[int, str]:
+    if not TRANSLATE_BATCHED:
+        translated_texts = await asyncio.gather(*(translate_text(channel, original_text) for channel in LANGUAGE_CHANNELS))
+        return {channel.channel_id: translated_text for channel, translated_text in zip(LANGUAGE_CHANNELS, translated_texts)}
+
+    translated_texts = {}
+    for channel in LANGUAGE_CHANNELS:
+        translated_text = original_text if channel.is_default else await get_cached_translation(channel, original_text)
+        if translated_text:
+            translated_texts[channel.channel_id] = translated_text
+
+    missing_channels = [channel for channel in LANGUAGE_CHANNELS if channel.channel_id not in translated_texts]
+    if len(missing_channels) > 1:
+        translated_texts.update(await translate_batch(missing_channels, original_text))
+
+    missing_channels = [channel for channel in LANGUAGE_CHANNELS if channel.channel_id not in translated_texts]
+    fallback_texts = await asyncio.gather(*(translate_text(channel, original_text) for channel in missing_channels))
+    translated_texts.update({channel.channel_id: translated_text for channel, translated_text in zip(missing_channels, fallback_texts)})
+
+    return translated_texts
+
+
+def pretranslate_post(post_id: int, original_text: str):
+    task_text, task = pretranslation_tasks.get(post_id, (None, None))
+    if task and task_text == original_text:
+        return
+
+    discard_pretranslation(post_id)
+
+    task = asyncio.create_task(translate_post(original_text))
+    task.add_done_callback(partial(on_pretranslation_done, post_id))
+    pretranslation_tasks[post_id] = (original_text, task)
+
+
+def discard_pretranslation(post_id: int):
+    _, task = pretranslation_tasks.pop(post_id, (None, None))
+    if task:
+        task.cancel()
+
+
+def on_pretranslation_done(post_id: int, task: asyncio.Task):
+    if pretranslation_tasks.get(post_id, (None, None))[1] is task:
+        del pretranslation_tasks[post_id]  # the translations are in the cache now
+
+    if not task.cancelled() and task.exception():
+        logging.warning("Pre-translation failed", exc_info=task.exception())
+
+
+async def get_post_translations(post_id: int, original_text: str) -> dict[int, str]:
+    task_text, task = pretranslation_tasks.pop(post_id, (None, None))
+    if task and task_text == original_text:
+        with suppress(Exception):
+            return await task
+    elif task:
+        task.cancel()
+
+    return await translate_post(original_text)
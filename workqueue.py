@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+import metrics
+
+
+class WorkQueue:
+    def __init__(self, name: str, handler: Callable[[Any], Awaitable], maxsize: int, workers: int, drop_oldest: bool = True, on_drop: Optional[Callable[[Any], Awaitable]] = None):
+        self.name = name
+        self.handler = handler
+        self.maxsize = maxsize
+        self.workers = workers
+        self.drop_oldest = drop_oldest
+        self.on_drop = on_drop
+
+        self.pending: dict[Hashable, Any] = {}
+        self.enqueued_at: dict[Hashable, float] = {}
+        self.keys: asyncio.Queue[Hashable] = asyncio.Queue()
+        self.worker_tasks: list[asyncio.Task] = []
+        self.drop_tasks: set[asyncio.Task] = set()
+
+        self.enqueued = 0
+        self.merged = 0
+        self.dropped = 0
+        self.processed = 0
+        self.failed = 0
+
+        metrics.QUEUE_DEPTH.set_function(lambda: self.depth, queue=name)
+        for event_name in ("enqueued", "merged", "dropped", "processed", "failed"):
+            metrics.QUEUE_EVENTS.set_function(lambda event_name=event_name: getattr(self, event_name), queue=name, event=event_name)
+
+    @property
+    def depth(self) -> int:
+        return len(self.pending)
+
+    def put(self, key: Hashable, item: Any) -> bool:
+        if key in self.pending:
+            self.pending[key] = item
+            self.merged += 1
+            return True
+
+        if self.depth >= self.maxsize:
+            if not self.drop_oldest:
+                self.drop(key, item)
+                return False
+
+            oldest_key = next(iter(self.pending))
+            self.enqueued_at.pop(oldest_key, None)
+            self.drop(oldest_key, self.pending.pop(oldest_key))
+
+        self.pending[key] = item
+        self.enqueued_at[key] = time.perf_counter()
+        self.keys.put_nowait(key)
+        self.enqueued += 1
+        return True
+
+    def drop(self, key: Hashable, item: Any):
+        self.dropped += 1
+        logging.warning("%s queue is full (%s items), dropping %s", self.name, self.maxsize, key)
+
+        if self.on_drop:
+            drop_task = asyncio.create_task(self.run_on_drop(key, item))
+            self.drop_tasks.add(drop_task)
+            drop_task.add_done_callback(self.drop_tasks.discard)
+
+    async def run_on_drop(self, key: Hashable, item: Any):
+        try:
+            await self.on_drop(item)
+        except Exception:
+            logging.exception("%s queue failed to drop %s", self.name, key)
+
+    async def run_worker(self):
+        while True:
+            key = await self.keys.get()
+            if key not in self.pending:
+                continue
+
+            metrics.QUEUE_WAIT_DURATION.observe(time.perf_counter() - self.enqueued_at.pop(key), queue=self.name)
+            try:
+                await self.handler(self.pending.pop(key))
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+                logging.exception("%s queue failed to process %s", self.name, key)
+
+    def start(self):
+        self.worker_tasks = [asyncio.create_task(self.run_worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for worker_task in self.worker_tasks:
+            worker_task.cancel()
+
+        await asyncio.gather(*self.worker_tasks, *self.drop_tasks, return_exceptions=True)
+        self.worker_tasks = []